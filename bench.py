@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from csv import writer, field_size_limit, QUOTE_ALL
+from datetime import datetime, timedelta
+from multiprocessing import Process, Queue
+from sqlite3 import connect
+
+import main
+
+try:
+    import resource
+except ImportError:  # not on Windows, peak RSS is not reported
+    resource = None
+
+# loader: (step recording its rows, steps creating its tables, function)
+bench_loaders = {
+    "load_so_from_xml": ("2_load_so_from_xml", [main.create_database], main.load_so_from_xml),
+    "load_sotorrent": ("6_load_sotorrent",
+                       [main.create_database, main.create_sotorrent_tables], main.load_sotorrent),
+    "load_postreferencegh": ("7_load_postreferencegh",
+                             [main.create_database, main.create_sotorrent_tables],
+                             main.load_postreferencegh),
+    "load_ghmatches": ("8_load_ghmatches",
+                       [main.create_database, main.create_sotorrent_tables], main.load_ghmatches),
+}
+bench_inputs = {
+    "load_so_from_xml": ["{}.xml".format(table) for table in main.so_xml_tables],
+    "load_sotorrent": ["{}.csv".format(table.name) for table in main.sotorrent_csv_tables],
+    "load_postreferencegh": ["{}.csv".format(main.postreferencegh_csv_table.name)],
+    "load_ghmatches": ["{}.csv".format(main.ghmatches_csv_table.name)],
+}
+
+words = ["the", "a", "value", "list", "python", "sqlite", "query", "returns", "error",
+         "function", "when", "I", "try", "to", "call", "it", "with", "null", "index",
+         "über", "naïve", "日本語", "файл", "données", "why", "does", "this", "fail"]
+code_lines = ["x = 1 && y < 2", "if (a > b) { return \"s\"; }", "\tfor i in range(10):",
+              "SELECT * FROM t WHERE c = 'x';", "printf(\"%d\\n\", i);", "a = b & c | d",
+              "<div class=\"x\">&nbsp;</div>", "    return {'k': v}"]
+tag_names = ["python", "java", "c#", "c++", "javascript", "sqlite", "sql", "regex",
+             "node.js", "asp.net", "r", "go", "rust", "html", "css", ".net"]
+# every 1000th GHMatches row, and the last of a smaller dump, is longer than
+# csv's default field_size_limit (read before main.py raises it)
+wide_line_every = 1000
+wide_line_length = field_size_limit() + 1000
+
+
+def html_escape(value):
+    return (value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace('"', "&quot;"))
+
+
+def xml_escape(value):
+    return html_escape(value).replace("\r", "&#xD;").replace("\n", "&#xA;")
+
+
+def csv_newlines(value):
+    """Newlines of SOTorrent csv text columns, stored as '&#xD;&#xA;'"""
+    return value.replace("\n", "&#xD;&#xA;")
+
+
+class DumpGenerator(object):
+    """Writes Stack Exchange xml and SOTorrent csv files of random but
+    realistic rows: html bodies with code, entities, tabs, \\r\\n and non
+    ascii text, missing optional attributes, empty nullable csv columns,
+    quoted csv fields spanning lines and wide GHMatches lines
+    """
+
+    def __init__(self, directory, rows, seed=0):
+        self.directory = directory
+        self.rows = rows
+        self.users = max(rows // 10, 2)
+        self.random = random.Random(seed)
+        self.start = datetime(2008, 7, 31, 21, 42, 52)
+
+    def date(self, i, sep="T"):
+        when = self.start + timedelta(seconds=i * 3607 + self.random.randrange(3600),
+                                      milliseconds=self.random.randrange(1000))
+        return when.strftime("%Y-%m-%d{}%H:%M:%S.%f".format(sep))[:-3]
+
+    def csv_date(self, i):
+        return self.date(i, " ")[:-4]
+
+    def text(self, count):
+        return " ".join(self.random.choice(words) for _ in range(count))
+
+    def code(self, count):
+        return "\n".join(self.random.choice(code_lines) for _ in range(count))
+
+    def body(self):
+        parts = []
+        for _ in range(self.random.randint(1, 4)):
+            if self.random.random() < 0.4:
+                parts.append("<pre><code>{}</code></pre>".format(
+                    html_escape(self.code(self.random.randint(1, 8)))))
+            else:
+                parts.append("<p>{}</p>".format(self.text(self.random.randint(5, 60))))
+        return ("\r\n" if self.random.random() < 0.1 else "\n").join(parts)
+
+    def user_id(self):
+        return self.random.choice([-1] + list(range(1, 20))) if self.random.random() < 0.1 \
+            else self.random.randint(1, self.users)
+
+    def post_id(self):
+        return self.random.randint(1, self.rows)
+
+    def maybe(self, value, chance=0.7):
+        return value if self.random.random() < chance else None
+
+    def write_xml(self, table, rows):
+        path = os.path.join(self.directory, "{}.xml".format(table))
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            f.write('﻿<?xml version="1.0" encoding="utf-8"?>\n<{}>\n'.format(table.lower()))
+            for row in rows:
+                f.write("  <row {} />\n".format(" ".join(
+                    '{}="{}"'.format(key, xml_escape(str(value)))
+                    for key, value in row if value is not None)))
+            f.write("</{}>\n".format(table.lower()))
+
+    def write_csv(self, table, rows):
+        path = os.path.join(self.directory, "{}.csv".format(table.name))
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            csv_writer = writer(f, quoting=QUOTE_ALL, lineterminator="\n")
+            if table.skip_header:
+                csv_writer.writerow(table.columns)
+            for row in rows:
+                csv_writer.writerow(["" if value is None else value for value in row])
+
+    def generate(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_xml("Users", self.users_rows())
+        self.write_xml("Badges", self.badges_rows())
+        self.write_xml("Posts", self.posts_rows())
+        self.write_xml("Comments", self.comments_rows())
+        self.write_xml("PostHistory", self.posthistory_rows())
+        self.write_xml("PostLinks", self.postlinks_rows())
+        self.write_xml("Tags", self.tags_rows())
+        self.write_xml("Votes", self.votes_rows())
+        tables = dict((table.name, table) for table in main.sotorrent_csv_tables)
+        self.write_csv(tables["PostBlockDiff"], self.postblockdiff_rows())
+        self.write_csv(tables["PostVersion"], self.postversion_rows())
+        self.write_csv(tables["PostBlockVersion"], self.postblockversion_rows())
+        self.write_csv(tables["PostVersionUrl"], self.url_rows(True))
+        self.write_csv(tables["CommentUrl"], self.url_rows(False))
+        self.write_csv(tables["TitleVersion"], self.titleversion_rows())
+        self.write_csv(main.postreferencegh_csv_table, self.postreferencegh_rows())
+        self.write_csv(main.ghmatches_csv_table, self.ghmatches_rows())
+
+    def users_rows(self):
+        for i in [-1] + list(range(1, self.users + 1)):
+            yield [("Id", i), ("Reputation", self.random.randint(1, 100000)),
+                   ("CreationDate", self.date(i)), ("DisplayName", "user{} {}".format(i, self.text(1))),
+                   ("LastAccessDate", self.date(i + 100)),
+                   ("WebsiteUrl", self.maybe("https://example.com/{}?a=1&b=2".format(i), 0.3)),
+                   ("Location", self.maybe(self.text(2), 0.5)),
+                   ("AboutMe", self.maybe("<p>{}</p>".format(self.text(30)), 0.4)),
+                   ("Views", self.random.randint(0, 5000)), ("UpVotes", self.random.randint(0, 900)),
+                   ("DownVotes", self.random.randint(0, 90)), ("AccountId", self.maybe(i + 1000, 0.95))]
+
+    def badges_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [("Id", i), ("UserId", self.random.randint(1, self.users)),
+                   ("Name", self.random.choice(["Teacher", "Student", "Editor", "python"])),
+                   ("Date", self.date(i)), ("Class", self.random.randint(1, 3)),
+                   ("TagBased", self.random.choice(["False", "True"]))]
+
+    def posts_rows(self):
+        question = None
+        next_answer = False  # whether post i + 1 answers the last question
+        for i in range(1, self.rows + 1):
+            is_question = not next_answer
+            next_answer = i < self.rows and self.random.random() >= 0.4
+            row = [("Id", i), ("PostTypeId", 1 if is_question else 2)]
+            if is_question:
+                question = i
+                row += [("AcceptedAnswerId", self.maybe(i + 1, 0.3) if next_answer else None)]
+            else:
+                row += [("ParentId", question)]
+            row += [("CreationDate", self.date(i)), ("Score", self.random.randint(-5, 500)),
+                    ("ViewCount", self.random.randint(1, 90000) if is_question else None),
+                    ("Body", self.body()), ("OwnerUserId", self.maybe(self.user_id(), 0.95)),
+                    ("LastEditorUserId", self.maybe(self.user_id(), 0.3)),
+                    ("LastEditDate", self.maybe(self.date(i + 50), 0.3)),
+                    ("LastActivityDate", self.date(i + 60))]
+            if is_question:
+                row += [("Title", self.text(8)),
+                        ("Tags", "".join("<{}>".format(tag) for tag in self.random.sample(
+                            tag_names, self.random.randint(1, 5)))),
+                        ("AnswerCount", self.random.randint(0, 5))]
+            row += [("CommentCount", self.random.randint(0, 9)),
+                    ("FavoriteCount", self.maybe(self.random.randint(0, 50), 0.2)),
+                    ("ClosedDate", self.maybe(self.date(i + 70), 0.05))]
+            yield row
+
+    def comments_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [("Id", i), ("PostId", self.post_id()), ("Score", self.random.randint(0, 20)),
+                   ("Text", self.text(self.random.randint(3, 40)) +
+                    (" `a\tb`" if self.random.random() < 0.05 else "")),
+                   ("CreationDate", self.date(i)), ("UserId", self.maybe(self.user_id(), 0.98))]
+
+    def posthistory_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [("Id", i), ("PostHistoryTypeId", self.random.choice([1, 2, 3, 5, 6, 10])),
+                   ("PostId", self.post_id()), ("RevisionGUID", "{:032x}".format(self.random.getrandbits(128))),
+                   ("CreationDate", self.date(i)), ("UserId", self.maybe(self.user_id(), 0.95)),
+                   ("Comment", self.maybe(self.text(5), 0.3)), ("Text", self.maybe(self.body(), 0.9))]
+
+    def postlinks_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [("Id", i), ("CreationDate", self.date(i)), ("PostId", self.post_id()),
+                   ("RelatedPostId", self.post_id()), ("LinkTypeId", self.random.choice([1, 3]))]
+
+    def tags_rows(self):
+        for i, tag in enumerate(tag_names, 1):
+            yield [("Id", i), ("TagName", tag), ("Count", self.random.randint(1, 10 ** 6)),
+                   ("ExcerptPostId", self.maybe(self.post_id(), 0.8)),
+                   ("WikiPostId", self.maybe(self.post_id(), 0.8))]
+
+    def votes_rows(self):
+        for i in range(1, self.rows + 1):
+            vote_type = self.random.choice([1, 2, 2, 2, 3, 5, 8])
+            yield [("Id", i), ("PostId", self.post_id()), ("VoteTypeId", vote_type),
+                   ("UserId", self.user_id() if vote_type in (5, 8) else None),
+                   ("CreationDate", self.date(i)[:10] + "T00:00:00.000"),
+                   ("BountyAmount", 50 if vote_type == 8 else None)]
+
+    def content(self, code):
+        value = self.code(self.random.randint(1, 12)) if code else self.text(self.random.randint(3, 80))
+        if self.random.random() < 0.05:
+            return value  # a quoted field spanning lines
+        return csv_newlines(value)
+
+    def postblockdiff_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [i, self.post_id(), i, self.random.randint(1, 9), i, i, self.random.randint(1, 9),
+                   max(i - 1, 1), self.random.choice([-1, 0, 1]), self.content(self.random.random() < 0.4)]
+
+    def postversion_rows(self):
+        for i in range(1, self.rows + 1):
+            yield [i, self.post_id(), self.random.choice([1, 2]), i, self.random.choice([2, 5, 8]),
+                   self.csv_date(i), self.maybe(i - 1, 0.5) if i > 1 else None,
+                   self.maybe(i + 1, 0.5), self.random.choice([0, 1])]
+
+    def postblockversion_rows(self):
+        for i in range(1, self.rows + 1):
+            has_pred = i > 1 and self.random.random() < 0.6
+            code = self.random.random() < 0.4
+            content = self.content(code)
+            yield [i, 2 if code else 1, self.post_id(), i, self.random.randint(1, 9),
+                   i - 1 if has_pred else None, i - 1 if has_pred else None,
+                   self.random.randint(1, 9) if has_pred else None,
+                   self.maybe(max(i - 2, 1), 0.5) if has_pred else None,
+                   self.maybe(max(i - 2, 1), 0.5) if has_pred else None, None,
+                   self.random.choice([0, 1]) if has_pred else None,
+                   round(self.random.random(), 3) if has_pred else None,
+                   self.maybe(self.random.randint(1, 3), 0.6), self.maybe(self.random.randint(0, 3), 0.6),
+                   len(content), content.count("&#xD;&#xA;") + 1, content, self.random.choice([0, 1])]
+
+    def url_rows(self, post_version):
+        protocol, domain = None, None
+        for i in range(1, self.rows + 1):
+            protocol = self.random.choice(["https", "http"])
+            domain = self.random.choice(["stackoverflow.com", "github.com", "docs.python.org",
+                                         "en.wikipedia.org", "example.com"])
+            complete_domain = self.random.choice(["", "www."]) + domain
+            path = self.maybe("/questions/{}/{}".format(i, self.text(1)), 0.8)
+            query = self.maybe("q={}&page=2".format(i), 0.2)
+            url = "{}://{}{}{}".format(protocol, complete_domain, path or "",
+                                       "?" + query if query else "")
+            row = [i, self.post_id()]
+            row += [i, i] if post_version else [i]
+            row += [self.random.choice(["MarkdownLink", "Bare", "AnchorTag"]),
+                    self.random.choice(["Inline", "Reference"]),
+                    self.maybe(csv_newlines(self.text(3) + "\n" + self.text(2)), 0.4),
+                    protocol, domain, complete_domain, path, query,
+                    self.maybe("section-{}".format(i), 0.05), url,
+                    csv_newlines("[link]({})\n".format(url))]
+            yield row
+
+    def titleversion_rows(self):
+        for i in range(1, self.rows + 1):
+            has_pred = i > 1 and self.random.random() < 0.3
+            yield [i, self.post_id(), 1, i, self.random.choice([1, 4, 7]), self.csv_date(i),
+                   "{}, \"{}\"".format(self.text(6), self.text(1)),
+                   i - 1 if has_pred else None, self.random.randint(1, 40) if has_pred else None,
+                   None, None]
+
+    def postreferencegh_rows(self):
+        for i in range(1, self.rows + 1):
+            owner, name = self.text(1), self.random.choice(tag_names)
+            path = "src/{}/{}.py".format(self.text(1), i)
+            yield ["{:040x}".format(self.random.getrandbits(160)), "{}/{}".format(owner, name),
+                   owner, name, "master", path, ".py", self.random.randint(10, 10 ** 6),
+                   self.random.randint(1, 10), self.post_id(), self.maybe(self.post_id(), 0.1),
+                   "https://stackoverflow.com/a/{}".format(i),
+                   "https://github.com/{}/{}/blob/master/{}".format(owner, name, path)]
+
+    def ghmatches_rows(self):
+        for i in range(1, self.rows + 1):
+            if i % wide_line_every == 0 or self.rows < wide_line_every and i == self.rows:
+                matched = "x" * wide_line_length
+            else:
+                matched = self.code(self.random.randint(1, 3))
+            yield ["{:040x}".format(self.random.getrandbits(160)),
+                   ";".join(str(self.post_id()) for _ in range(self.random.randint(1, 4))),
+                   csv_newlines(matched)]
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and its finished children"""
+    if resource is None:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss if sys.platform == "darwin" else rss * 1024  # KiB on Linux
+
+
+def _run_loader(loader, data_dir, db_path, options, results):
+    """Process running one loader on a new database, reporting its measures"""
+    main.script_dir = data_dir
+    main.db_file = db_path
+    sys.stdout = open(os.devnull, "w")
+    step, setup, load = bench_loaders[loader]
+    conn = connect(db_path)
+    main.register_functions(conn)
+    main.apply_pragmas(conn, main.build_profiles[options["profile"]])
+    main.create_progress_table(conn)
+    main.set_metadata(conn, [(name, int(name in options["build_options"]))
+                             for name in main.storage_options] +
+                      [(key, "") for key in ("subset_tags", "subset_year", "subset_ids")])
+    for create in setup:
+        create(conn)
+    t_start = datetime.now()
+    load(conn, options["workers"])
+    seconds = (datetime.now() - t_start).total_seconds()
+    rows = conn.execute("SELECT sum(Rows) FROM BuildProgress WHERE Step = ? AND TableName != ''",
+                        (step,)).fetchone()[0] or 0
+    conn.close()
+    results.put((rows, seconds, peak_rss()))
+
+
+def run_loader(loader, data_dir, options):
+    """Return the measures of one loader run on the inputs in data_dir"""
+    db_dir = tempfile.mkdtemp(prefix="bench-db-")
+    db_path = os.path.join(db_dir, main.db_file_name)
+    try:
+        results = Queue()
+        proc = Process(target=_run_loader, args=(loader, data_dir, db_path, options, results))
+        proc.start()
+        proc.join()
+        if proc.exitcode:
+            raise RuntimeError("{} failed with exit code {}".format(loader, proc.exitcode))
+        rows, seconds, rss = results.get()
+        input_bytes = sum(os.path.getsize(os.path.join(data_dir, name))
+                          for name in bench_inputs[loader])
+        db_bytes = os.path.getsize(db_path)
+    finally:
+        shutil.rmtree(db_dir)
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_s": rows / max(seconds, 1e-9),
+        "mb_per_s": input_bytes / 1e6 / max(seconds, 1e-9),
+        "peak_rss_mb": None if rss is None else rss / 1e6,
+        "db_bytes_per_row": db_bytes / max(rows, 1),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return a note on result against its baseline and whether it regressed
+
+    A baseline run with other options (workers, profile, build options or
+    seed) is not compared.
+    """
+    if baseline is None:
+        return "", False
+    options, baseline_options = result["options"], baseline["options"]
+    if baseline_options != options:
+        return "not compared, baseline ran with {}".format(", ".join(
+            "{} {}".format(name, baseline_options.get(name))
+            for name in sorted(set(options) | set(baseline_options))
+            if options.get(name) != baseline_options.get(name))), False
+    ratio = result["rows_per_s"] / max(baseline["rows_per_s"], 1e-9)
+    regressed = ratio < 1 - tolerance
+    return "{:.2f}x baseline{}".format(ratio, ", SLOWER" if regressed else ""), regressed
+
+
+def run_benchmarks(args):
+    options = {"workers": args.workers, "profile": args.profile,
+               "build_options": sorted(args.build_option or []), "seed": args.seed}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        for r in saved["results"]:
+            # results saved before their options were, e.g. without seed
+            r.setdefault("options", saved["options"])
+            baseline[r["loader"], r["size"]] = r
+    results = []
+    regressions = 0
+    print("{:<22} {:>9} {:>10} {:>10} {:>8} {:>10} {:>10}  {}".format(
+        "loader", "size", "rows", "rows/s", "MB/s", "peak MB", "bytes/row", ""))
+    for size in args.sizes:
+        data_dir = os.path.join(args.data, str(size)) if args.data else tempfile.mkdtemp(
+            prefix="bench-data-")
+        try:
+            if not os.path.exists(os.path.join(data_dir, "Posts.xml")):
+                DumpGenerator(data_dir, size, args.seed).generate()
+            for loader in args.loaders:
+                result = max((run_loader(loader, data_dir, options) for _ in range(args.repeat)),
+                             key=lambda r: r["rows_per_s"])
+                result.update(loader=loader, size=size, options=options)
+                note, regressed = compare(result, baseline.get((loader, size)), args.tolerance)
+                regressions += regressed
+                results.append(result)
+                print("{:<22} {:>9} {:>10} {:>10.0f} {:>8.2f} {:>10} {:>10.1f}  {}".format(
+                    loader, size, result["rows"], result["rows_per_s"], result["mb_per_s"],
+                    "-" if result["peak_rss_mb"] is None else "{:.0f}".format(result["peak_rss_mb"]),
+                    result["db_bytes_per_row"], note))
+        finally:
+            if not args.data:
+                shutil.rmtree(data_dir)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"options": options, "results": results}, f, indent=2)
+    return 1 if regressions else 0
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Generate synthetic SOTorrent dumps and benchmark "
+                                        "the loaders of main.py on them")
+    commands = parser.add_subparsers(dest="command")
+    generate = commands.add_parser("generate", help="write a synthetic dump to a directory")
+    generate.add_argument("directory")
+    generate.add_argument("--rows", type=int, default=10000, help="rows per table")
+    generate.add_argument("--seed", type=int, default=0)
+    run = commands.add_parser("run", help="benchmark the loaders at several sizes")
+    run.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                     metavar="ROWS", help="rows per table of each generated dump")
+    run.add_argument("--loaders", nargs="+", choices=sorted(bench_loaders),
+                     default=sorted(bench_loaders))
+    run.add_argument("--workers", type=int, default=0, metavar="N",
+                     help="parse workers, as main.py --workers")
+    run.add_argument("--profile", choices=sorted(main.build_profiles), default="default",
+                     help="PRAGMA profile, as main.py --profile")
+    run.add_argument("--build-option", action="append", choices=main.storage_options,
+                     help="storage option to build with, e.g. typed (repeatable)")
+    run.add_argument("--repeat", type=int, default=1, metavar="N",
+                     help="run each loader N times and keep the fastest run")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--data", metavar="DIR",
+                     help="keep the generated dumps in DIR/<size> and reuse them "
+                          "(default: generate into a temporary directory)")
+    run.add_argument("--save", metavar="FILE", help="write the results as json to FILE")
+    run.add_argument("--baseline", metavar="FILE",
+                     help="compare rows/s against results saved with --save, exit "
+                          "with 1 if a loader is slower by more than --tolerance")
+    run.add_argument("--tolerance", type=float, default=0.1,
+                     help="fraction of baseline rows/s a run may lose (default: 0.1)")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("choose a command, generate or run")
+    return args
+
+
+def bench():
+    args = parse_args()
+    if args.command == "generate":
+        DumpGenerator(args.directory, args.rows, args.seed).generate()
+        return 0
+    return run_benchmarks(args)
+
+
+if __name__ == "__main__":
+    sys.exit(bench())
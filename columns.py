@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+from argparse import ArgumentParser
+from array import array
+from datetime import datetime
+from mmap import mmap, ACCESS_READ
+
+import main
+from sotorrent import ReadPool
+
+try:
+    import numpy
+except ImportError:  # columns are read as memoryviews instead
+    numpy = None
+
+manifest_name = "manifest.json"
+
+# numeric columns exported by table as (column, array typecode), DATETIME
+# columns are exported as milliseconds since 1970
+export_columns = {
+    "Votes": [("Id", "q"), ("PostId", "q"), ("VoteTypeId", "b"), ("UserId", "q"),
+              ("CreationDate", "q"), ("BountyAmount", "i")],
+    "PostBlockVersion": [("Id", "q"), ("PostId", "q"), ("PostHistoryId", "q"),
+                         ("PostBlockTypeId", "b"), ("PredSimilarity", "d"), ("PredCount", "i"),
+                         ("SuccCount", "i"), ("Length", "i"), ("LineCount", "i")],
+    "TitleVersion": [("Id", "q"), ("PostId", "q"), ("PostHistoryId", "q"),
+                     ("PredEditDistance", "i"), ("SuccEditDistance", "i")],
+    "PostReferenceGH": [("Id", "q"), ("PostId", "q"), ("Size", "q"), ("Copies", "i")],
+}
+date_columns = {("Votes", "CreationDate")}
+
+
+def null_value(typecode):
+    """Value standing for NULL in a column of typecode: NaN or the type's minimum"""
+    if typecode in "fd":
+        return float("nan")
+    return -(1 << (8 * array(typecode).itemsize - 1))
+
+
+def column_converter(table, column, typecode):
+    null = null_value(typecode)
+    if (table, column) in date_columns:
+        return lambda value: null if value is None else (
+            main.to_timestamp(value) if isinstance(value, str) else value)
+    if typecode in "fd":
+        return lambda value: null if value is None else float(value)
+    return lambda value: null if value is None else int(value)
+
+
+def export_table(pool, directory, table):
+    """Write every column of export_columns[table] to <directory>/<table>.<column>
+
+    Rows are streamed in batches of commit_block, so memory does not grow
+    with the table.  Return the manifest entry of the table.
+    """
+    columns = export_columns[table]
+    converters = [column_converter(table, column, typecode) for column, typecode in columns]
+    files = [open(os.path.join(directory, "{}.{}".format(table, column)), "wb")
+             for column, _ in columns]
+    rows = 0
+    try:
+        cursor = pool.query("SELECT {} FROM {} ORDER BY Id;".format(
+            ", ".join(column for column, _ in columns), table))
+        batch = []
+        for row in cursor:
+            batch.append(row)
+            if len(batch) == main.commit_block:
+                rows += write_batch(files, columns, converters, batch)
+                batch = []
+        rows += write_batch(files, columns, converters, batch)
+    finally:
+        for f in files:
+            f.close()
+    return {"rows": rows, "columns": dict(
+        (column, {"file": "{}.{}".format(table, column), "typecode": typecode,
+                  "null": None if typecode in "fd" else null_value(typecode)})
+        for column, typecode in columns)}
+
+
+def write_batch(files, columns, converters, batch):
+    for i, (f, (_, typecode), convert) in enumerate(zip(files, columns, converters)):
+        array(typecode, [convert(row[i]) for row in batch]).tofile(f)
+    return len(batch)
+
+
+def export(db_file, directory, tables=None):
+    """Export the numeric columns of tables (default: all of export_columns)
+
+    The manifest is written last, a directory without one holds an
+    interrupted export.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, manifest_name)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    pool = ReadPool(db_file, size=1)
+    manifest = {"byteorder": sys.byteorder, "db_file": os.path.basename(db_file),
+                "tables": {}}
+    try:
+        for table in tables or sorted(export_columns):
+            t_start = datetime.now()
+            manifest["tables"][table] = export_table(pool, directory, table)
+            print("\tExported {} took {} ({} rows)".format(
+                table, datetime.now() - t_start, manifest["tables"][table]["rows"]))
+    finally:
+        pool.close()
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+class ColumnStore(object):
+    """Columns exported by export(), memory mapped read-only
+
+    column() returns a numpy array when numpy is installed and a memoryview
+    otherwise, both reading the file in place without copying it, e.g.
+
+        store = ColumnStore("columns")
+        votes = store.column("Votes", "VoteTypeId")
+        upvotes = (votes == 2).sum()  # numpy
+        similarity = store.column("PostBlockVersion", "PredSimilarity")
+
+    NULLs are NaN in floating point columns and the smallest value of the
+    type in integer columns, see null().
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, manifest_name)) as f:
+            self.manifest = json.load(f)
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError("{} was exported on a {} endian machine".format(
+                directory, self.manifest["byteorder"]))
+        self.maps = {}
+
+    def rows(self, table):
+        return self.manifest["tables"][table]["rows"]
+
+    def null(self, table, column):
+        return null_value(self.manifest["tables"][table]["columns"][column]["typecode"])
+
+    def column(self, table, column):
+        entry = self.manifest["tables"][table]["columns"][column]
+        typecode = entry["typecode"]
+        if not self.rows(table):
+            return numpy.empty(0, typecode) if numpy is not None else memoryview(
+                array(typecode))
+        if entry["file"] not in self.maps:
+            with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+                self.maps[entry["file"]] = mmap(f.fileno(), 0, access=ACCESS_READ)
+        buffer = self.maps[entry["file"]]
+        if numpy is not None:
+            return numpy.frombuffer(buffer, dtype=typecode)
+        return memoryview(buffer).cast(typecode)
+
+    def close(self):
+        """Unmap the files, arrays returned by column() must be released first"""
+        for buffer in self.maps.values():
+            buffer.close()
+        self.maps = {}
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Export numeric columns of {} to flat binary "
+                                        "files for ColumnStore".format(main.db_file_name))
+    parser.add_argument("directory", help="directory of the column files and their manifest")
+    parser.add_argument("--db", default=main.db_file, metavar="FILE",
+                        help="database to export (default: %(default)s)")
+    parser.add_argument("--tables", nargs="+", choices=sorted(export_columns),
+                        help="tables to export (default: all)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    export(args.db, args.directory, args.tables)
@@ -1,16 +1,106 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
+import json
+from argparse import ArgumentParser
 from csv import reader, field_size_limit
 from sqlite3 import connect, Error
-from xml.etree.ElementTree import iterparse
-from datetime import datetime
+from xml.etree.ElementTree import XMLPullParser, iterparse
+from datetime import date, datetime, timedelta
+from collections import namedtuple
+from hashlib import blake2b
+from gzip import GzipFile
+from io import StringIO
+from itertools import groupby, zip_longest
+from operator import itemgetter
+from multiprocessing import Process, Queue
+from queue import Empty, Queue as LocalQueue
+from threading import Semaphore, Thread
+from time import time, perf_counter
+from traceback import format_exc
+from zlib import compress, decompress
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 db_file_name = "sotorrent.sqlite3"
 db_file = os.path.join(script_dir, db_file_name)
-commit_block = 100000  # arbitrary
+commit_block = 100000  # rows per batch of the FTS, PostVersionText and columns.py fills
+commit_bytes_limits = (1 << 22, 1 << 28)  # input bytes per load_source commit
+commit_seconds = 60  # longest load_source transaction, bounds the work lost on a crash
+# a commit below this fraction of its table's average rows/s is warned about
+slow_commit_fraction = 0.25
+read_block = 1 << 21  # bytes of input parsed as one chunk
+gzip_block = 1 << 20  # bytes read and decompressed at a time
+gzip_queue_bound = 16  # decompressed blocks buffered ahead of the parser
+compress_level = 6  # zlib level of --compress columns
+
+# PRAGMAs applied for the duration of the build, see --profile
+build_profiles = {
+    "default": (),
+    "bulk": (
+        "PRAGMA journal_mode = OFF;",
+        "PRAGMA synchronous = OFF;",
+        "PRAGMA cache_size = -1048576;",  # KiB, 1 GiB
+        "PRAGMA temp_store = MEMORY;",
+        "PRAGMA locking_mode = EXCLUSIVE;",
+        "PRAGMA mmap_size = 68719476736;",
+    ),
+    "bulk-wal": (
+        "PRAGMA journal_mode = WAL;",
+        "PRAGMA synchronous = OFF;",
+        "PRAGMA cache_size = -1048576;",  # KiB, 1 GiB
+        "PRAGMA temp_store = MEMORY;",
+        "PRAGMA locking_mode = EXCLUSIVE;",
+        "PRAGMA mmap_size = 68719476736;",
+    ),
+}
+# PRAGMAs leaving the finished database durable and tuned for readers
+read_profile = (
+    # leaving WAL first, an exclusive lock taken in WAL mode is kept until then
+    "PRAGMA journal_mode = DELETE;",
+    "PRAGMA locking_mode = NORMAL;",
+    "PRAGMA synchronous = FULL;",
+    "PRAGMA analysis_limit = 1000;",
+    "ANALYZE;",
+)
+
+
+def schema_sql(conn, sql_create):
+    """Return a CREATE TABLE statement as used by the build
+
+    With --compact-schema an "Id INT" primary key is declared INTEGER, so it
+    is the rowid itself and not a second b-tree, AUTOINCREMENT is dropped as
+    every Id comes from the input and the small type tables keyed by a
+    TINYINT are stored WITHOUT ROWID.  With --dedup-content the columns of
+    deduplicated_columns refer to their content table by id, with
+    --intern-urls the columns of interned_columns to their dictionary.
+    """
+    if build_option(conn, "dedup_content"):
+        for table, (column, content_table) in deduplicated_columns.items():
+            if "CREATE TABLE {} (".format(table) in sql_create:
+                sql_create = sql_create.replace(
+                    "{} TEXT NOT NULL,".format(column),
+                    "{}Id INT NOT NULL,".format(column)).replace(
+                    "FOREIGN KEY(", "FOREIGN KEY({}Id) REFERENCES {}(Id),\n"
+                    "            FOREIGN KEY(".format(column, content_table), 1)
+    if build_option(conn, "intern_urls"):
+        for table, (columns, dictionary) in interned_columns.items():
+            if "CREATE TABLE {} (".format(table) in sql_create:
+                for column in columns:
+                    sql_create = sql_create.replace(
+                        "{} TEXT NOT NULL,".format(column),
+                        "{}Id INT NOT NULL,".format(column)).replace(
+                        "FOREIGN KEY(", "FOREIGN KEY({}Id) REFERENCES {}(Id),\n"
+                        "            FOREIGN KEY(".format(column, dictionary), 1)
+    if not build_option(conn, "compact_schema"):
+        return sql_create
+    sql_create = sql_create.replace(
+        "INTEGER PRIMARY KEY AUTOINCREMENT", "INTEGER PRIMARY KEY")
+    sql_create = re.sub(r"(\(\s+Id) INT NOT NULL", r"\1 INTEGER NOT NULL", sql_create, 1)
+    if re.search(r"\(\s+Id TINYINT NOT NULL", sql_create):
+        sql_create = sql_create.rstrip().rstrip(";") + " WITHOUT ROWID;"
+    return sql_create
 
 
 def create_database(conn):
@@ -198,76 +288,1149 @@ def create_database(conn):
             FOREIGN KEY (PostId) REFERENCES Posts(Id),
             FOREIGN KEY (UserId) REFERENCES Users(Id)
         );"""
+    # --post-tags, the tags of each post by Tags.Id, clustered by tag
+    sql_create_posttags = """
+        CREATE TABLE PostTags (
+            TagId INT NOT NULL,
+            PostId INT NOT NULL,
+            PRIMARY KEY (TagId, PostId),
+            FOREIGN KEY (TagId) REFERENCES Tags(Id),
+            FOREIGN KEY (PostId) REFERENCES Posts(Id)
+        ) WITHOUT ROWID;"""
 
     c = conn.cursor()
 
     # PostType
-    c.execute(sql_create_posttype)
+    c.execute(schema_sql(conn, sql_create_posttype))
     c.executemany(sql_insert_posttype, sql_posttypes)
 
     # PostHistoryType
-    c.execute(sql_create_posthistorytype)
+    c.execute(schema_sql(conn, sql_create_posthistorytype))
     c.executemany(sql_insert_posthistorytype, sql_posthistorytypes)
 
     # Data Tables
-    c.execute(sql_create_users)
-    c.execute(sql_create_badges)
-    c.execute(sql_create_posts)
-    c.execute(sql_create_comments)
-    c.execute(sql_create_posthistory)
-    c.execute(sql_create_postlinks)
-    c.execute(sql_create_tags)
-    c.execute(sql_create_votes)
+    c.execute(schema_sql(conn, sql_create_users))
+    c.execute(schema_sql(conn, sql_create_badges))
+    c.execute(schema_sql(conn, sql_create_posts))
+    c.execute(schema_sql(conn, sql_create_comments))
+    c.execute(schema_sql(conn, sql_create_posthistory))
+    c.execute(schema_sql(conn, sql_create_postlinks))
+    c.execute(schema_sql(conn, sql_create_tags))
+    c.execute(schema_sql(conn, sql_create_votes))
+    if build_option(conn, "post_tags"):
+        c.execute(sql_create_posttags)
 
     conn.commit()
     print("1_create_database done")
 
 
-def load_so_from_xml(conn):
-    """sqlite version of 2_load_so_from_xml.sql"""
-    print("2_load_so_from_xml begin")
-    c = conn.cursor()
+def create_progress_table(conn):
+    """BuildProgress tracks finished steps and committed rows of each table"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS BuildProgress (
+            Step VARCHAR(64) NOT NULL,
+            TableName VARCHAR(64) NOT NULL DEFAULT '',
+            Rows INT NOT NULL DEFAULT 0,
+            ByteOffset INT NOT NULL DEFAULT 0,
+            Done BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY(Step, TableName)
+        );""")
+    conn.commit()
 
-    tables = ["Users", "Badges", "Posts", "Comments",
-              "PostHistory", "PostLinks", "Tags", "Votes"]
 
-    for table in tables:
-        # load from xml
-        xml_filepath = os.path.join(script_dir, "{}.xml".format(table))
-        context = iterparse(xml_filepath, events=("end",))
+def get_progress(conn, step, table=""):
+    """Return (rows, byte offset, done) recorded for a step or one of its tables"""
+    row = conn.execute("""
+        SELECT Rows, ByteOffset, Done FROM BuildProgress
+            WHERE Step = ? AND TableName = ?
+        """, (step, table)).fetchone()
+    if row is None:
+        return 0, 0, False
+    return row[0], row[1], bool(row[2])
 
-        t_start = datetime.now()
-        print("\tStarting {} at {}".format(table, t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        counter = 0
-        commit_counter = 0
-        for _, elm in context:
+
+def set_progress(conn, step, table="", rows=0, offset=0, done=False):
+    """Record progress, committed with the caller's transaction"""
+    conn.execute("INSERT OR REPLACE INTO BuildProgress VALUES (?, ?, ?, ?, ?)",
+                 (step, table, rows, offset, done))
+
+
+def process_rss():
+    """Resident set size of this process in bytes, None where unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def database_sizes(conn):
+    """Return (database bytes, rollback journal or write-ahead log bytes) of conn"""
+    filepath = conn.execute("PRAGMA database_list;").fetchone()[2]
+    if not filepath:
+        return 0, 0
+    sizes = [os.path.getsize(path) if os.path.exists(path) else 0
+             for path in (filepath, filepath + "-journal", filepath + "-wal")]
+    return sizes[0], sizes[1] + sizes[2]
+
+
+class MetricsLog(object):
+    """Appends build events to a json lines file (--metrics)
+
+    Every event is one json object with its name, the time in seconds since
+    1970 and the run it belongs to.  Shard processes append their events to
+    the same file, the summary at the end sums up the table events of the
+    run from the file.
+    """
+
+    def __init__(self, filepath, run=None):
+        self.filepath = filepath
+        self.run = run or "{}-{}".format(int(time()), os.getpid())
+        self.f = open(filepath, "a", buffering=1)
+
+    def event(self, event, **fields):
+        record = {"event": event, "time": round(time(), 3), "run": self.run}
+        record.update(fields)
+        self.f.write(json.dumps(record) + "\n")
+
+    def summary(self):
+        """Write and print the rows, time and limiting phase of every table"""
+        tables = []
+        with open(self.filepath) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["run"] == self.run and record["event"] == "table":
+                    tables.append(record)
+        for record in tables:
+            phases = dict((phase, record[phase + "_s"]) for phase in ("parse", "bind", "commit"))
+            record["limit"] = max(phases, key=phases.get)
+        self.event("summary", tables=[dict((key, record[key]) for key in (
+            "step", "table", "rows", "seconds", "rows_per_s", "parse_s", "bind_s",
+            "commit_s", "limit")) for record in tables])
+        print("{:<20} {:>12} {:>10} {:>10} {:>9} {:>9} {:>9}  limit".format(
+            "table", "rows", "seconds", "rows/s", "parse s", "bind s", "commit s"))
+        for record in tables:
+            print("{:<20} {:>12} {:>10.1f} {:>10.0f} {:>9.1f} {:>9.1f} {:>9.1f}  {}".format(
+                record["table"], record["rows"], record["seconds"], record["rows_per_s"],
+                record["parse_s"], record["bind_s"], record["commit_s"], record["limit"]))
+
+    def close(self):
+        self.f.close()
+
+
+metrics = None  # MetricsLog of --metrics
+
+
+def run_step(conn, step, func, *args):
+    """Run func(conn, *args) unless step is already recorded as done"""
+    if get_progress(conn, step)[2]:
+        print("{} already done, skipping".format(step))
+        return
+    t_start = time()
+    if metrics:
+        metrics.event("step_start", step=step)
+    func(conn, *args)
+    set_progress(conn, step, done=True)
+    conn.commit()
+    if metrics:
+        metrics.event("step_done", step=step, seconds=round(time() - t_start, 3))
+
+
+def input_path(file_name):
+    """Path of an input file, falling back to its gzipped version"""
+    filepath = os.path.join(script_dir, file_name)
+    if not os.path.exists(filepath) and os.path.exists(filepath + ".gz"):
+        return filepath + ".gz"
+    return filepath
+
+
+def open_input(filepath):
+    """Open an input file for binary reading, decompressing .gz files"""
+    if filepath.endswith(".gz"):
+        return GzipInput(filepath)
+    return open(filepath, "rb", buffering=gzip_block)
+
+
+def disk_position(f):
+    """Bytes of the file on disk consumed so far"""
+    if isinstance(f, GzipInput):
+        return f.disk_tell()
+    return f.tell()
+
+
+class GzipInput(object):
+    """Binary reader over a .gz file decompressed by a background thread
+
+    The thread inflates gzip_block sized blocks into a bounded queue, so
+    decompression overlaps with parsing and inserting.  Seeking is only
+    supported forward and is done by decompressing up to the offset.
+    """
+
+    def __init__(self, filepath):
+        self.raw = open(filepath, "rb", buffering=gzip_block)
+        self.gzip = GzipFile(fileobj=self.raw, mode="rb")
+        self.blocks = LocalQueue(gzip_queue_bound)
+        self.buf = b""
+        self.offset = 0
+        self.position = 0
+        self.eof = False
+        self.closed = False
+        self.thread = Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def _decompress(self):
+        try:
+            while not self.closed:
+                data = self.gzip.read(gzip_block)
+                self.blocks.put((data, self.raw.tell()))
+                if not data:
+                    return
+        except Exception as e:
+            self.blocks.put((e, None))
+
+    def _fill(self, size):
+        """Buffer at least size bytes unless the end of input comes first"""
+        if len(self.buf) >= size or self.eof:
+            return
+        parts = [self.buf]
+        buffered = len(self.buf)
+        while buffered < size:
+            data, position = self.blocks.get()
+            if isinstance(data, Exception):
+                raise data
+            if not data:
+                self.eof = True
+                break
+            parts.append(data)
+            buffered += len(data)
+            self.position = position
+        self.buf = b"".join(parts)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = sys.maxsize
+        self._fill(size)
+        data = self.buf[:size]
+        self.buf = self.buf[size:]
+        self.offset += len(data)
+        return data
+
+    def readline(self):
+        while b"\n" not in self.buf and not self.eof:
+            self._fill(len(self.buf) + 1)
+        cut = self.buf.find(b"\n") + 1 or len(self.buf)
+        return self.read(cut)
+
+    def seek(self, offset):
+        if offset < self.offset:
+            raise ValueError("GzipInput only seeks forward")
+        while self.offset < offset:
+            if not self.read(min(offset - self.offset, gzip_block)):
+                break
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def disk_tell(self):
+        return self.position
+
+    def close(self):
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.blocks.get(timeout=0.1)  # unblock the thread
+            except Empty:
+                pass
+        self.gzip.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_chunks(f, quoted, skip_header=False, offset=0):
+    """Yield (start, end, data) byte chunks of f cut on record boundaries
+
+    Stack Exchange xml dumps hold one <row/> per line, so any newline is a
+    boundary.  In the csv files a quoted field may span lines, so a newline
+    is only a boundary when it is preceded by an even number of quotes.
+    Reading starts at byte offset, which must be a record boundary.
+    """
+    if offset:
+        f.seek(offset)
+    elif skip_header:
+        offset = len(f.readline())
+    tail = b""
+    while True:
+        data = f.read(read_block)
+        if not data:
+            if tail:
+                yield offset, offset + len(tail), tail
+            return
+        buf = tail + data
+        cut = buf.rfind(b"\n")
+        if quoted:
+            quotes = buf.count(b'"', 0, cut)
+            while cut >= 0 and quotes % 2:
+                prev = buf.rfind(b"\n", 0, cut)
+                quotes -= buf.count(b'"', prev + 1, cut)
+                cut = prev
+        if cut < 0:
+            tail = buf  # record longer than read_block, keep reading
+            continue
+        cut += 1
+        yield offset, offset + cut, buf[:cut]
+        offset += cut
+        tail = buf[cut:]
+
+
+_xml_key = re.compile(r"\s+([A-Za-z_][\w.-]*)\s*=\s*\Z")
+_xml_entity = re.compile(r"&(?:#x([0-9A-Fa-f]+)|#([0-9]+)|(lt|gt|amp|quot|apos));")
+_xml_named_entities = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+
+
+def _xml_entity_value(match):
+    hex_code, code, name = match.groups()
+    if name:
+        return _xml_named_entities[name]
+    return chr(int(hex_code, 16) if hex_code else int(code))
+
+
+def xml_unescape(value):
+    """Decode the entity references of an xml attribute value"""
+    if "&" not in value:
+        return value
+    # &amp; goes last, "&amp;lt;" must decode to "&lt;"
+    value = (value.replace("&#xA;", "\n").replace("&#xD;", "\r")
+             .replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"'))
+    if "&#" in value or "&apos;" in value:
+        return _xml_entity.sub(_xml_entity_value, value)
+    return value.replace("&amp;", "&")
+
+
+def xml_row_columns(shape):
+    """Attribute names of a line split on its quotes, if it is a plain <row/>
+
+    shape holds the text around the quoted values, e.g.
+    ('  <row Id=', ' PostId=', ' />').  Returns None for anything else.
+    """
+    head = shape[0].lstrip()
+    if len(shape) < 2 or not head.startswith("<row") or shape[-1].strip() != "/>":
+        return None
+    columns = []
+    for key in (head[4:],) + shape[1:-1]:
+        match = _xml_key.match(key)
+        if match is None:
+            return None
+        columns.append(match.group(1))
+    if len(set(columns)) != len(columns):
+        return None
+    return tuple(columns)
+
+
+def table_columns(conn, table):
+    """Return [(column, default value), ...] of a table in declaration order"""
+    columns = []
+    for _, name, _, _, default, _ in conn.execute(
+            "PRAGMA table_info({});".format(table)).fetchall():
+        if default is not None:
+            # let sqlite evaluate the DEFAULT clause, e.g. 0, FALSE or 'x'
+            default = conn.execute("SELECT {};".format(default)).fetchone()[0]
+        columns.append((name, default))
+    return columns
+
+
+_timestamp = re.compile(r"(\d{4}-\d\d-\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,3}))?\Z")
+_unix_epoch = date(1970, 1, 1).toordinal()
+_day_timestamps = {}
+_booleans = {"True": 1, "False": 0, "true": 1, "false": 0, "1": 1, "0": 0}
+
+
+def to_timestamp(value):
+    """Milliseconds since 1970 of a date like 2008-07-31T21:42:52.667"""
+    match = _timestamp.match(value)
+    if match is None:
+        raise ValueError(value)
+    day, hour, minute, second, fraction = match.groups()
+    timestamp = _day_timestamps.get(day)
+    if timestamp is None:
+        ordinal = datetime.strptime(day, "%Y-%m-%d").toordinal()
+        timestamp = _day_timestamps[day] = (ordinal - _unix_epoch) * 86400000
+    hour, minute, second = int(hour), int(minute), int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(value)
+    fraction = int(fraction.ljust(3, "0")) if fraction else 0
+    return timestamp + ((hour * 60 + minute) * 60 + second) * 1000 + fraction
+
+
+def to_boolean(value):
+    return _booleans[value]
+
+
+def column_converters(conn, table, columns):
+    """Return [(index, convert), ...] storing columns as their declared type
+
+    INT columns become integers, DOUBLE floats, BOOLEAN and TINYINT(1)
+    0 or 1 and DATETIME milliseconds since 1970, the views of storage_view_sql()
+    show booleans and dates as in the input again.
+    """
+    types = dict((name, decl.upper()) for _, name, decl, _, _, _ in conn.execute(
+        "PRAGMA table_info({});".format(storage_table(conn, table))).fetchall())
+    converters = []
+    for i, column in enumerate(columns):
+        decl = types.get(column, "")
+        if decl in ("BOOLEAN", "TINYINT(1)"):
+            converters.append((i, to_boolean))
+        elif "INT" in decl:
+            converters.append((i, int))
+        elif decl == "DOUBLE":
+            converters.append((i, float))
+        elif decl == "DATETIME":
+            converters.append((i, to_timestamp))
+    return converters
+
+
+def _coerce_value(convert, value):
+    try:
+        return convert(value)
+    except (TypeError, ValueError, KeyError):
+        return value  # NULL, empty or malformed, stored as it is
+
+
+def coerce_rows(rows, converters):
+    """Return rows with the values of converted columns in place of their text
+
+    Every column is converted as a whole, only a column holding values that
+    do not convert (NULLs, empty strings) is retried value by value.
+    """
+    if not rows or not converters:
+        return rows
+    columns = list(zip(*rows))
+    for i, convert in converters:
+        try:
+            columns[i] = list(map(convert, columns[i]))
+        except (TypeError, ValueError, KeyError):
+            column = columns[i]
+            try:
+                columns[i] = [None if value is None else convert(value) for value in column]
+            except (TypeError, ValueError, KeyError):
+                columns[i] = [_coerce_value(convert, value) for value in column]
+    return list(zip(*columns))
+
+
+# large text columns stored zlib compressed with --compress
+compressed_columns = {
+    "Posts": ("Body",),
+    "PostHistory": ("Text",),
+    "PostBlockVersion": ("Content",),
+    "PostBlockDiff": ("Text",),
+    "GHMatches": ("MatchedLine",),
+    "PostVersionText": ("Content",),
+}
+
+
+# columns stored once per distinct value with --dedup-content, as
+# {table: (column, content table)}
+deduplicated_columns = {
+    "PostBlockVersion": ("Content", "PostBlockContent"),
+}
+
+
+# columns stored as ids of their distinct values with --intern-urls, as
+# {table: (columns, dictionary table)}; every table has a dictionary of its
+# own, so tables loaded into different shards do not share ids
+interned_columns = {
+    "PostVersionUrl": (("Protocol", "RootDomain", "CompleteDomain"), "PostVersionUrlPart"),
+    "CommentUrl": (("Protocol", "RootDomain", "CompleteDomain"), "CommentUrlPart"),
+}
+intern_cache_size = 1 << 16  # values a parser remembers as already in the dictionary
+
+
+# columns of delimited ids split into a junction table with --ghmatch-posts,
+# as {table: (column, separator, junction table, (id column, key column))}
+junction_columns = {
+    "GHMatches": ("PostIds", ";", "GHMatchPost", ("PostId", "FileId")),
+}
+
+
+def compress_text(value):
+    """Return value as a zlib compressed utf-8 BLOB, unless that is not smaller"""
+    if not value:
+        return value
+    data = value.encode("utf-8")
+    compressed = compress(data, compress_level)
+    return compressed if len(compressed) < len(data) else value
+
+
+def decompress_text(value):
+    """SQL function decompress_text(), the inverse of compress_text()"""
+    if isinstance(value, bytes):
+        return decompress(value).decode("utf-8")
+    return value
+
+
+def register_functions(conn):
+    """Define the SQL functions used by the views of a --compress database"""
+    conn.create_function("decompress_text", 1, decompress_text)
+
+
+def storage_converters(conn, table, columns):
+    """Converters of a loaded table's columns for the storage options it is built with"""
+    converters = []
+    if build_option(conn, "typed"):
+        converters += column_converters(conn, table, columns)
+    if build_option(conn, "compress"):
+        converters += [(columns.index(column), compress_text)
+                       for column in compressed_columns.get(table, ()) if column in columns]
+    return converters
+
+
+class IdSet(object):
+    """Set of integer Ids kept as a bitmap, one bit per Id up to the largest"""
+
+    def __init__(self, ids=()):
+        self.bits = bytearray()
+        self.negative = set()  # e.g. the Community user, Id -1
+        for i in ids:
+            self.add(i)
+
+    def add(self, i):
+        if i < 0:
+            self.negative.add(i)
+            return
+        byte = i >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (i & 7)
+
+    def __contains__(self, i):
+        if i < 0:
+            return i in self.negative
+        byte = i >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (i & 7)))
+
+    def __len__(self):
+        return sum(bin(byte).count("1") for byte in self.bits) + len(self.negative)
+
+
+def split_ids(value, separator):
+    """Return the ids listed in value, e.g. [12, 34] of GHMatches.PostIds
+    '12; 34;;x': tokens are stripped and empty or non-numeric ones skipped
+    """
+    return [int(token) for token in (token.strip() for token in value.split(separator))
+            if token.isdecimal()]
+
+
+def _in_subset(value, ids, separator):
+    if value is None or value == "":
+        return False
+    if separator:
+        return any(i in ids for i in split_ids(value, separator))
+    return int(value) in ids
+
+
+def filter_rows(rows, filters):
+    """Return the rows whose values of the filtered columns are all in their IdSet
+
+    filters holds (index, ids, separator), a column with a separator lists
+    several Ids of which one has to be in ids.
+    """
+    for i, ids, separator in filters:
+        rows = [row for row in rows if _in_subset(row[i], ids, separator)]
+    return rows
+
+
+class XmlSource(object):
+    """Parses chunks of <table>.xml into insert batches
+
+    columns is table_columns() of the table.  Every row is bound in that
+    order, with the column default for missing attributes, so the whole
+    table goes through one prepared insert statement.  Only rows passing
+    filters are loaded and converters are applied to them, see filter_rows()
+    and coerce_rows().  filters None are the table's --subset filters,
+    built by load_source() once the table's load starts.
+    """
+
+    # attribute values cannot hold a literal quote, so quote parity keeps a
+    # row with literal newlines in its values within one chunk
+    quoted = True
+    skip_header = False
+    side_tables = ()  # tables filled along with table
+
+    def __init__(self, table, columns, converters=(), filters=()):
+        self.table = table
+        self.columns = columns
+        self.converters = converters
+        self.filters = filters
+        self.column_names = [name for name, _ in columns]
+        self.file_name = "{}.xml".format(table)
+        self.shapes = {}
+        self.layouts = {}
+        self.parser = None
+        self.root = None
+        self.pending = False
+        self.sql_insert = "INSERT INTO {table} ({columns}) VALUES ({q_s})".format(
+            table=table,
+            columns=", ".join(name for name, _ in columns),
+            q_s=", ".join(["?" for _ in columns])
+        )
+
+    def __reduce__(self):
+        return (self.__class__, (self.table, self.columns, self.converters, self.filters))
+
+    def parse(self, start, data):
+        """Return [(sql_insert, rows)] for the <row/> elements in data"""
+        layouts = self.layouts
+        rows = []
+        for columns, values in self.scan(start, data):
+            layout = layouts.get(columns)
+            if layout is None:
+                layout = layouts[columns] = self.layout(columns)
+            getter, missing = layout
+            rows.append(getter(values + missing))
+        rows = filter_rows(rows, self.filters)
+        return [(self.sql_insert, coerce_rows(rows, self.converters))]
+
+    def layout(self, columns):
+        """Return (getter, missing) placing the values of a row with the given
+        attributes in table order: getter(values + missing) is the bound row
+        """
+        names = [name for name, _ in self.columns]
+        unknown = [column for column in columns if column not in names]
+        if unknown:
+            print("\n\tignoring {} attributes {}".format(self.table, ", ".join(unknown)))
+        missing = []
+        order = []
+        for name, default in self.columns:
+            if name in columns:
+                order.append(columns.index(name))
+            else:
+                order.append(len(columns) + len(missing))
+                missing.append(default)
+        return itemgetter(*order), missing
+
+    def scan(self, start, data):
+        """Yield (columns, values) for each <row/> in data, in input order
+
+        The dumps hold one <row attr="value" .../> per line.  Such a line is
+        split on its quotes, giving the values directly, and the text around
+        the values is checked once per distinct attribute layout.  Lines that
+        do not fit, e.g. rows spanning lines or values holding literal tabs
+        that xml would normalize, are parsed by ElementTree instead.
+        """
+        text = data.decode("utf-8")
+        # decoding &lt; and &gt; cannot move quotes or newlines, so it is
+        # done once for the whole chunk
+        lines = text.replace("&lt;", "<").replace("&gt;", ">").split("\n")
+        raw_lines = None
+        shapes = self.shapes
+        for i, line in enumerate(lines):
+            if not self.pending:
+                parts = line.split('"')
+                shape = tuple(parts[0::2])
+                columns = shapes.get(shape, False)
+                if columns is False:
+                    columns = shapes[shape] = xml_row_columns(shape)
+                if columns is not None and "\t" not in line and "\r" not in line[:-1]:
+                    if "&" in line:
+                        yield columns, [xml_unescape(value) for value in parts[1::2]]
+                    else:
+                        yield columns, parts[1::2]
+                    continue
+                if not line.lstrip().startswith("<row"):
+                    continue  # xml declaration, root element tags, blank lines
+            if raw_lines is None:
+                raw_lines = text.split("\n")
+            for row in self.fallback(raw_lines[i] + "\n"):
+                yield row
+
+    def fallback(self, line):
+        """Yield (columns, values) of rows completed by feeding ElementTree line"""
+        if self.parser is None:
+            # rows are fed to one long lived parser under a synthetic root,
+            # so chunks can be parsed in any process without the real root
+            self.parser = XMLPullParser(events=("start", "end"))
+            self.parser.feed(b"<rows>")
+        self.parser.feed(line)
+        self.pending = True
+        for event, elm in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elm
+                continue
             if elm.tag != "row":
                 continue
-            columns = elm.keys()
-            values = [elm.get(column) for column in columns]
-            sql_insert = "INSERT INTO {table} ({columns}) VALUES ({q_s})".format(
-                table=table,
-                columns=", ".join(columns),
-                q_s=", ".join(["?" for _ in range(0, len(columns))])
-            )
-            # print(sql_insert, [values])
-            c.execute(sql_insert, values)
+            columns = tuple(elm.keys())
+            yield columns, [elm.get(column) for column in columns]
+            self.pending = False
+        if not self.pending:
+            # parsed rows are no longer needed
+            self.root.clear()
+
+
+class TaggedXmlSource(XmlSource):
+    """XmlSource of Posts also writing the tags of each post to PostTags
+    (--post-tags)
+
+    Tags like '<python><sqlite3>' are interned to the Ids of Tags.xml, which
+    is read when the source is made as Tags are loaded after Posts.  Tags
+    missing from Tags.xml are not linked.
+    """
+
+    side_tables = ("PostTags",)
+    sql_insert_tags = "INSERT OR IGNORE INTO PostTags (TagId, PostId) VALUES (?, ?)"
+
+    def __init__(self, table, columns, converters=(), filters=(), tag_ids=None):
+        super(TaggedXmlSource, self).__init__(table, columns, converters, filters)
+        self.tag_ids = read_tag_ids() if tag_ids is None else tag_ids
+        names = [name for name, _ in columns]
+        self.id_index = names.index("Id")
+        self.tags_index = names.index("Tags")
+
+    def __reduce__(self):
+        return (self.__class__, (self.table, self.columns, self.converters, self.filters,
+                                 self.tag_ids))
+
+    def parse(self, start, data):
+        """Return [(sql_insert, rows), (sql_insert_tags, pairs)] for data"""
+        batches = super(TaggedXmlSource, self).parse(start, data)
+        tag_ids = self.tag_ids
+        i, t = self.id_index, self.tags_index
+        pairs = []
+        for row in batches[0][1]:
+            if row[t]:
+                post_id = int(row[i])
+                pairs.extend((tag_ids[tag], post_id) for tag in row[t][1:-1].split("><")
+                             if tag in tag_ids)
+        return batches + [(self.sql_insert_tags, pairs)]
+
+
+def read_tag_ids():
+    """Return {TagName: Id} of Tags.xml"""
+    source = XmlSource("Tags", [])
+    tag_ids = {}
+    with open_input(input_path(source.file_name)) as f:
+        for start, _, data in read_chunks(f, source.quoted):
+            for columns, values in source.scan(start, data):
+                row = dict(zip(columns, values))
+                tag_ids[row["TagName"]] = int(row["Id"])
+    return tag_ids
+
+
+def xml_source(conn, table):
+    # the --subset filters are built by load_source() if the table is loaded
+    columns = table_columns(conn, storage_table(conn, table))
+    names = [name for name, _ in columns]
+    converters = storage_converters(conn, table, names)
+    if table == "Posts" and build_option(conn, "post_tags"):
+        return TaggedXmlSource(table, columns, converters, None)
+    return XmlSource(table, columns, converters, None)
+
+
+def verify_xml_scanner(filepath):
+    """Check that XmlSource.scan yields the same rows as iterparse for a file
+
+    Returns the number of mismatching rows, printing the first few.
+    """
+    print("verify_xml_scanner {}".format(filepath))
+    table = os.path.basename(filepath).split(".")[0]
+    source = XmlSource(table, [])
+    mismatches = 0
+    counter = 0
+    with open_input(filepath) as f, open_input(filepath) as g:
+        scanned = (dict(zip(columns, values))
+                   for start, _, data in read_chunks(f, source.quoted)
+                   for columns, values in source.scan(start, data))
+        parsed = (dict(elm.attrib)
+                  for _, elm in iterparse(g, events=("end",)) if elm.tag == "row")
+        for scanned_row, parsed_row in zip_longest(scanned, parsed):
             counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
+            if scanned_row != parsed_row:
+                mismatches += 1
+                if mismatches <= 5:
+                    print("\trow {} differs:\n\t\tscanned {}\n\t\tparsed  {}".format(
+                        counter, scanned_row, parsed_row))
+    print("\t{} rows, {} mismatches".format(counter, mismatches))
+    return mismatches
 
-            # Clean up no longer needed elements
-            elm.clear()
-        # del context
 
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-        print("\n\t{} took {} ({} rows)".format(
-            table, datetime.now() - t_start, counter))
+def parsed_chunks(source, offset=0):
+    """Yield (end, disk position, batches) for each chunk of source, parsed in process"""
+    with open_input(input_path(source.file_name)) as f:
+        for start, end, data in read_chunks(f, source.quoted, source.skip_header, offset):
+            yield end, disk_position(f), source.parse(start, data)
+
+
+def _read_worker(source, offset, tasks, results, outstanding):
+    """Thread feeding the chunks of source to the parse workers"""
+    count = 0
+    try:
+        with open_input(input_path(source.file_name)) as f:
+            for start, end, data in read_chunks(f, source.quoted, source.skip_header, offset):
+                outstanding.acquire()
+                tasks.put((count, start, end, disk_position(f), data))
+                count += 1
+    except Exception:
+        results.put((None, format_exc()))
+    results.put((None, count))
+
+
+def _parse_worker(source, tasks, results, csv_field_size_limit):
+    """Process parsing chunks from tasks into batches on results"""
+    field_size_limit(csv_field_size_limit)
+    try:
+        for seq, start, end, position, data in iter(tasks.get, None):
+            results.put((seq, (end, position, source.parse(start, data))))
+    except Exception:
+        results.put((None, format_exc()))
+
+
+def pipelined_chunks(source, workers, offset=0):
+    """Yield (end, disk position, batches) for each chunk of source, parsed by workers
+
+    Chunks are handed out to the workers over a bounded queue and the parsed
+    batches are yielded back in input order.  At most queue_bound chunks are
+    read but not yet written, so memory stays flat however far the workers
+    get ahead of the writer.
+    """
+    queue_bound = 2 * workers + 2
+    tasks = Queue(queue_bound)
+    results = Queue(queue_bound)
+    outstanding = Semaphore(queue_bound)
+    procs = [Process(target=_parse_worker,
+                     args=(source, tasks, results, field_size_limit()),
+                     daemon=True)
+             for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    reader_thread = Thread(target=_read_worker,
+                           args=(source, offset, tasks, results, outstanding),
+                           daemon=True)
+    reader_thread.start()
+    try:
+        pending = {}
+        next_seq = 0
+        total = None
+        while total is None or next_seq < total:
+            if next_seq not in pending:
+                try:
+                    seq, batches = results.get(timeout=1)
+                except Empty:
+                    if any(proc.exitcode for proc in procs):
+                        raise RuntimeError("a parse worker for {} died".format(
+                            source.file_name))
+                    continue
+                if seq is None:
+                    if isinstance(batches, str):
+                        raise RuntimeError(
+                            "parsing {} failed:\n{}".format(source.file_name, batches))
+                    total = batches
+                else:
+                    pending[seq] = batches
+                continue
+            yield pending.pop(next_seq)
+            outstanding.release()
+            next_seq += 1
+        for _ in procs:
+            tasks.put(None)
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+
+
+class CommitPolicy(object):
+    """Decides when load_source commits, sizing transactions per table
+
+    A transaction is committed once it holds target bytes of input or is
+    commit_seconds old, so wide and narrow rows get transactions of similar
+    size.  After each commit the target moves by step in the direction that
+    last raised the throughput (input bytes per second, commit included)
+    and turns back when it drops, growing while commits take most of the
+    time.  It stays within commit_bytes_limits; a maximum above half the
+    page cache is kept but warned about once, such transactions spill to the
+    database before their commit.
+    """
+
+    step = 1.5
+    warned = False  # about a maximum above half the page cache
+
+    def __init__(self, conn):
+        minimum, maximum = commit_bytes_limits
+        cache_size = conn.execute("PRAGMA cache_size;").fetchone()[0]
+        if cache_size < 0:
+            cache_bytes = -cache_size * 1024
+        else:
+            cache_bytes = cache_size * conn.execute("PRAGMA page_size;").fetchone()[0]
+        self.minimum = minimum
+        self.maximum = maximum
+        if maximum > cache_bytes // 2 and not CommitPolicy.warned:
+            CommitPolicy.warned = True
+            print("\tWarning: transactions of up to {} MiB of input exceed half the {:.0f} "
+                  "MiB page cache and may spill to the database before their commit, "
+                  "see --profile and --commit-mb".format(maximum >> 20, cache_bytes / (1 << 20)))
+        self.target = self.minimum
+        self.direction = 1
+        self.rate = None
+
+    def due(self, nbytes, seconds):
+        """Whether a transaction of nbytes input started seconds ago is committed now"""
+        return nbytes >= self.target or seconds >= commit_seconds
+
+    def committed(self, nbytes, seconds, commit_latency):
+        """Adapt the target to a transaction of nbytes taking seconds in total"""
+        rate = nbytes / max(seconds, 1e-9)
+        if commit_latency > seconds / 2:
+            self.direction = 1
+        elif self.rate is not None and rate < self.rate * 0.9:
+            self.direction = -self.direction
+        self.rate = rate
+        self.target = int(min(max(self.target * self.step ** self.direction,
+                                  self.minimum), self.maximum))
+
+
+def load_source(conn, step, source, workers=0, update=False):
+    """Insert every row of source, committing as CommitPolicy decides
+
+    The rows and input byte offset of every commit are recorded in
+    BuildProgress within the same transaction, so an interrupted load
+    continues from the last commit.  With update the rows are merged into
+    an existing table, see update_sql().
+    """
+    c = conn.cursor()
+    counter, offset, done = get_progress(conn, step, source.table)
+    if done:
+        print("\t{} already loaded ({} rows), skipping".format(source.table, counter))
+        return
+    if source.filters is None:  # see xml_source() and csv_source()
+        source.filters = subset_filters(conn, source.table, source.column_names)
+    filepath = input_path(source.file_name)
+    size = os.path.getsize(filepath)
+    # a gzipped input is decompressed from its start again when resuming
+    start_position = 0 if filepath.endswith(".gz") else offset
+    t_start = datetime.now()
+    resumed_rows = counter
+    if offset:
+        print("\tResuming {} at {} from row {} (byte {})".format(
+            source.table, t_start, counter, offset))
+    else:
+        print("\tStarting {} at {}".format(source.table, t_start))
+    c.execute("PRAGMA foreign_keys = OFF;")
+    if workers:
+        chunks = pipelined_chunks(source, workers, offset)
+    else:
+        chunks = parsed_chunks(source, offset)
+    commit_counter = 0
+    policy = CommitPolicy(conn)
+    uncommitted_bytes = 0
+    statements = {}
+    # seconds spent waiting for parsed chunks, in executemany and in commits
+    phases = {"parse": 0.0, "bind": 0.0, "commit": 0.0}
+    last_commit = dict(phases, time=perf_counter(), rows=counter, position=start_position)
+    t_load = t_phase = last_commit["time"]
+    for end, position, batches in chunks:
+        uncommitted_bytes += end - offset
+        offset = end
+        t_bind = perf_counter()
+        phases["parse"] += t_bind - t_phase
+        for sql_insert, rows in batches:
+            # rows of side tables (e.g. PostBlockContent) are not rows of the table
+            if sql_insert == source.sql_insert:
+                counter += len(rows)
+            if update:
+                if sql_insert not in statements:
+                    statements[sql_insert] = update_sql(conn, sql_insert)
+                sql_insert = statements[sql_insert]
+            c.executemany(sql_insert, rows)
+        t_phase = perf_counter()
+        phases["bind"] += t_phase - t_bind
+        if policy.due(uncommitted_bytes, t_phase - last_commit["time"]):
+            set_progress(conn, step, source.table, counter, offset)
+            conn.commit()  # must commit or all changes still in memory
+            t_commit = perf_counter()
+            phases["commit"] += t_commit - t_phase
+            policy.committed(uncommitted_bytes, t_commit - last_commit["time"],
+                             t_commit - t_phase)
+            t_phase = t_commit
+            commit_counter += 1
+            elapsed = datetime.now() - t_start
+            eta = timedelta(seconds=int(elapsed.total_seconds() * (size - position) /
+                                        max(position - start_position, 1)))
+            print("\r\tcommit no {}, elapsed: {}, read {:.1%} of {}, eta: {}".format(
+                commit_counter, elapsed, position / max(size, 1),
+                os.path.basename(filepath), eta), end="")
+            seconds = max(t_commit - last_commit["time"], 1e-9)
+            rows_per_s = (counter - last_commit["rows"]) / seconds
+            # against the rows/s of the earlier commits, unless --subset filters
+            # decide how many rows a commit has
+            average = (last_commit["rows"] - resumed_rows) / \
+                max(last_commit["time"] - t_load, 1e-9)
+            slow = commit_counter > 1 and not source.filters and \
+                rows_per_s < slow_commit_fraction * average
+            if slow:
+                print("\n\tWarning: commit no {} of {} ran at {:.0f} rows/s, below {:.0%} of "
+                      "the {:.0f} rows/s of its earlier commits".format(
+                          commit_counter, source.table, rows_per_s, slow_commit_fraction,
+                          average))
+            if metrics:
+                db_bytes, journal_bytes = database_sizes(conn)
+                metrics.event(
+                    "commit", step=step, table=source.table, commit=commit_counter,
+                    rows=counter, commit_rows=counter - last_commit["rows"],
+                    input_bytes=position, input_size=size, seconds=round(seconds, 3),
+                    rows_per_s=round(rows_per_s, 1),
+                    mb_per_s=round((position - last_commit["position"]) / 1e6 / seconds, 3),
+                    parse_s=round(phases["parse"] - last_commit["parse"], 3),
+                    bind_s=round(phases["bind"] - last_commit["bind"], 3),
+                    commit_s=round(phases["commit"] - last_commit["commit"], 3),
+                    db_bytes=db_bytes, journal_bytes=journal_bytes, rss_bytes=process_rss(),
+                    commit_bytes=uncommitted_bytes, target_bytes=policy.target)
+                if slow:
+                    metrics.event(
+                        "slow_commit", step=step, table=source.table, commit=commit_counter,
+                        rows_per_s=round(rows_per_s, 1), average_rows_per_s=round(average, 1),
+                        fraction=slow_commit_fraction, seconds=round(seconds, 3),
+                        parse_s=round(phases["parse"] - last_commit["parse"], 3),
+                        bind_s=round(phases["bind"] - last_commit["bind"], 3),
+                        commit_s=round(phases["commit"] - last_commit["commit"], 3))
+            uncommitted_bytes = 0
+            last_commit = dict(phases, time=t_commit, rows=counter, position=position)
+    c.execute("PRAGMA foreign_keys = ON;")
+    set_progress(conn, step, source.table, counter, offset, True)
+    t_commit = perf_counter()
+    conn.commit()
+    phases["commit"] += perf_counter() - t_commit
+    print("\n\t{} took {} ({} rows)".format(
+        source.table, datetime.now() - t_start, counter))
+    if metrics:
+        seconds = max((datetime.now() - t_start).total_seconds(), 1e-9)
+        db_bytes, journal_bytes = database_sizes(conn)
+        metrics.event(
+            "table", step=step, table=source.table, started=t_start.timestamp(),
+            rows=counter, input_size=size, seconds=round(seconds, 3),
+            rows_per_s=round((counter - resumed_rows) / seconds, 1),
+            mb_per_s=round((size - start_position) / 1e6 / seconds, 3),
+            parse_s=round(phases["parse"], 3), bind_s=round(phases["bind"], 3),
+            commit_s=round(phases["commit"], 3), commits=commit_counter + 1,
+            db_bytes=db_bytes, journal_bytes=journal_bytes, rss_bytes=process_rss())
+
+
+so_xml_tables = ["Users", "Badges", "Posts", "Comments",
+                 "PostHistory", "PostLinks", "Tags", "Votes"]
+# a --subset build loads the users referred to by the loaded tables last
+subset_xml_tables = ["Posts", "Comments", "PostHistory", "PostLinks",
+                     "Tags", "Votes", "Users", "Badges"]
+
+# columns of a --subset build's tables that refer to the selected Posts or
+# their users, a row is loaded if all of them do (PostIds lists several)
+subset_post_columns = {
+    "Comments": ("PostId",),
+    "PostHistory": ("PostId",),
+    "PostLinks": ("PostId", "RelatedPostId"),
+    "Votes": ("PostId",),
+    "PostVersion": ("PostId",),
+    "PostBlockVersion": ("PostId",),
+    "PostBlockDiff": ("PostId",),
+    "PostVersionUrl": ("PostId",),
+    "CommentUrl": ("PostId",),
+    "TitleVersion": ("PostId",),
+    "PostReferenceGH": ("PostId",),
+    "GHMatches": ("PostIds",),
+}
+subset_user_columns = {
+    "Users": ("Id",),
+    "Badges": ("UserId",),
+}
+subset_user_references = [("Posts", "OwnerUserId"), ("Posts", "LastEditorUserId"),
+                          ("Comments", "UserId"), ("PostHistory", "UserId"),
+                          ("Votes", "UserId")]
+
+
+def subset_criteria(conn):
+    """Return (tags, year, id range) of a --subset-* build, None for a full build"""
+    criteria = tuple(get_metadata(conn, key) for key in
+                     ["subset_tags", "subset_year", "subset_ids"])
+    if not any(criteria):
+        return None
+    return criteria
+
+
+def select_subset_posts(conn):
+    """Return the IdSet of Posts of a --subset build, in one pass over Posts.xml
+
+    Posts without a parent matching every --subset-* criterion are selected
+    along with the answers to them, which follow their question in
+    Posts.xml.  An answer is only selected through its question, so
+    ParentId and AcceptedAnswerId of the subset refer to loaded Posts.
+    """
+    tags, year, ids = subset_criteria(conn)
+    tags = ["<{}>".format(tag) for tag in tags.split(",")] if tags else []
+    first, last = [int(i) for i in ids.split(":")] if ids else (None, None)
+    t_start = datetime.now()
+    source = XmlSource("Posts", [])
+    selected = IdSet()
+    with open_input(input_path(source.file_name)) as f:
+        for start, _, data in read_chunks(f, source.quoted):
+            for columns, values in source.scan(start, data):
+                row = dict(zip(columns, values))
+                post_id = int(row["Id"])
+                parent_id = row.get("ParentId")
+                if parent_id:
+                    if int(parent_id) in selected:
+                        selected.add(post_id)
+                elif ids and not first <= post_id <= last:
+                    continue
+                elif year and not row.get("CreationDate", "").startswith(year):
+                    continue
+                elif tags and not any(tag in row.get("Tags", "") for tag in tags):
+                    continue
+                else:
+                    selected.add(post_id)
+    print("\tSelected {} Posts took {}".format(len(selected), datetime.now() - t_start))
+    return selected
+
+
+def subset_filters(conn, table, columns):
+    """Filters loading only the rows of table a --subset build refers to
+
+    Posts are selected from Posts.xml, the other tables are filtered by the
+    Posts (and users) already loaded, so their filters are built when their
+    load starts and not for the tables a resumed build has loaded.
+    """
+    if subset_criteria(conn) is None:
+        return []
+    if table == "Posts":
+        ids = select_subset_posts(conn)
+        references = ("Id",)
+    elif table in subset_post_columns:
+        ids = IdSet(post_id for (post_id,) in conn.execute("SELECT Id FROM Posts;"))
+        references = subset_post_columns[table]
+    elif table in subset_user_columns:
+        ids = IdSet(int(user_id) for table_name, column in subset_user_references
+                    for (user_id,) in conn.execute(
+                        "SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL;".format(
+                            column, table_name)))
+        references = subset_user_columns[table]
+    else:
+        return []  # e.g. Tags, loaded as a whole
+    return [(columns.index(column), ids, ";" if column == "PostIds" else None)
+            for column in references]
+
+
+def load_so_from_xml(conn, workers=0):
+    """sqlite version of 2_load_so_from_xml.sql"""
+    print("2_load_so_from_xml begin")
+
+    tables = so_xml_tables if subset_criteria(conn) is None else subset_xml_tables
+    for table in tables:
+        source = xml_source(conn, table)
+        load_source(conn, "2_load_so_from_xml", source, workers)
 
     print("2_load_so_from_xml done")
 
@@ -276,17 +1439,21 @@ def create_indicies(conn):
     """3_create_indicies.sql"""
     print("3_create_indicies begin")
     c = conn.cursor()
-    c.execute("CREATE INDEX comments_index_1 ON Comments(UserId);")
-    c.execute("CREATE INDEX comments_index_2 ON Comments(UserDisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS comments_index_1 ON Comments(UserId);")
+    c.execute("CREATE INDEX IF NOT EXISTS comments_index_2 ON Comments(UserDisplayName);")
 
-    c.execute("CREATE INDEX post_history_index_1 ON PostHistory(UserId);")
-    c.execute("CREATE INDEX post_history_index_2 ON PostHistory(UserDisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS post_history_index_1 ON PostHistory(UserId);")
+    c.execute("CREATE INDEX IF NOT EXISTS post_history_index_2 ON PostHistory(UserDisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS post_history_index_3 ON PostHistory(PostId);")
 
-    c.execute("CREATE INDEX posts_index_1 ON Posts(OwnerUserId);")
-    c.execute("CREATE INDEX posts_index_2 ON Posts(LastEditorUserId);")
-    c.execute("CREATE INDEX posts_index_3 ON Posts(OwnerDisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS posts_index_1 ON Posts(OwnerUserId);")
+    c.execute("CREATE INDEX IF NOT EXISTS posts_index_2 ON Posts(LastEditorUserId);")
+    c.execute("CREATE INDEX IF NOT EXISTS posts_index_3 ON Posts(OwnerDisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS posts_index_4 ON Posts(ParentId);")
 
-    c.execute("CREATE INDEX users_index_1 ON Users(DisplayName);")
+    c.execute("CREATE INDEX IF NOT EXISTS users_index_1 ON Users(DisplayName);")
+    if build_option(conn, "post_tags"):
+        c.execute("CREATE INDEX IF NOT EXISTS post_tags_index_1 ON PostTags(PostId);")
     conn.commit()
     print("3_create_indicies done")
 
@@ -469,348 +1636,324 @@ def create_sotorrent_tables(conn):
             PostIds TEXT NOT NULL,
             MatchedLine LONGTEXT NOT NULL
         );"""
+    # --dedup-content, every distinct PostBlockVersion.Content once
+    sql_create_postblockcontent = """
+        CREATE TABLE PostBlockContent (
+            Id INTEGER PRIMARY KEY,
+            Hash BLOB NOT NULL,
+            Content TEXT NOT NULL,
+            UNIQUE(Hash)
+        );"""
+    # --intern-urls, every distinct Protocol, RootDomain and CompleteDomain
+    # of a url table once
+    sql_create_urlpart = """
+        CREATE TABLE {} (
+            Id INTEGER PRIMARY KEY,
+            Value TEXT NOT NULL,
+            UNIQUE(Value)
+        );"""
+    # --ghmatch-posts, each post of GHMatches.PostIds with the file matching it
+    sql_create_ghmatchpost = """
+        CREATE TABLE GHMatchPost (
+            PostId INT NOT NULL,
+            FileId VARCHAR(40) NOT NULL,
+            PRIMARY KEY(PostId, FileId),
+            FOREIGN KEY(PostId) REFERENCES Posts(Id)
+        ) WITHOUT ROWID;"""
 
     c = conn.cursor()
     # PostBlockType
-    c.execute(sql_create_postblocktype)
+    c.execute(schema_sql(conn, sql_create_postblocktype))
     c.executemany(sql_insert_postblocktype, sql_postblocktypes)
 
     # PostBlockDiffOperation
-    c.execute(sql_create_postblockdiffoperation)
+    c.execute(schema_sql(conn, sql_create_postblockdiffoperation))
     c.executemany(sql_insert_postblockdiffoperations,
                   sql_postblockdiffoperations)
 
     # SO Torrent data tables
-    c.execute(sql_create_postversion)
-    c.execute(sql_create_postblockversion)
-    c.execute(sql_create_postblockdiff)
-    c.execute(sql_create_postversionurl)
-    c.execute(sql_create_commenturl)
-    c.execute(sql_create_postreferencegh)
-    c.execute(sql_create_titleversion)
-    c.execute(sql_create_ghmatches)
+    c.execute(schema_sql(conn, sql_create_postversion))
+    c.execute(schema_sql(conn, sql_create_postblockversion))
+    c.execute(schema_sql(conn, sql_create_postblockdiff))
+    c.execute(schema_sql(conn, sql_create_postversionurl))
+    c.execute(schema_sql(conn, sql_create_commenturl))
+    c.execute(schema_sql(conn, sql_create_postreferencegh))
+    c.execute(schema_sql(conn, sql_create_titleversion))
+    c.execute(schema_sql(conn, sql_create_ghmatches))
+    if build_option(conn, "dedup_content"):
+        c.execute(sql_create_postblockcontent)
+    if build_option(conn, "intern_urls"):
+        for _, dictionary in interned_columns.values():
+            c.execute(sql_create_urlpart.format(dictionary))
+    if build_option(conn, "ghmatch_posts"):
+        c.execute(sql_create_ghmatchpost)
 
     conn.commit()
     print("4_create_sotorrent_tables done")
 
 
-def load_sotorrent(conn):
+# Load spec for one SOTorrent csv file (<name>.csv)
+#   columns: column order of the csv file and of the insert statement
+#   nullable: columns whose empty values are stored as NULL
+#   newlines: columns whose '&#xD;&#xA;' sequences are decoded to '\n'
+#   skip_header: whether the first csv row is a header
+CsvTable = namedtuple(
+    "CsvTable", ["name", "columns", "nullable", "newlines", "skip_header"])
+
+sotorrent_csv_tables = [
+    CsvTable(
+        "PostBlockDiff",
+        ("Id", "PostId", "PostHistoryId", "LocalId", "PostBlockVersionId",
+         "PredPostHistoryId", "PredLocalId", "PredPostBlockVersionId",
+         "PostBlockDiffOperationId", "Text"),
+        nullable=(),
+        newlines=("Text",),
+        skip_header=False),
+    CsvTable(
+        "PostVersion",
+        ("Id", "PostId", "PostTypeId", "PostHistoryId", "PostHistoryTypeId",
+         "CreationDate", "PredPostHistoryId", "SuccPostHistoryId",
+         "MostRecentVersion"),
+        nullable=("PredPostHistoryId", "SuccPostHistoryId"),
+        newlines=(),
+        skip_header=False),
+    CsvTable(
+        "PostBlockVersion",
+        ("Id", "PostBlockTypeId", "PostId", "PostHistoryId", "LocalId",
+         "PredPostBlockVersionId", "PredPostHistoryId", "PredLocalId",
+         "RootPostBlockVersionId", "RootPostHistoryId", "RootLocalId",
+         "PredEqual", "PredSimilarity", "PredCount", "SuccCount", "Length",
+         "LineCount", "Content", "MostRecentVersion"),
+        nullable=("PredPostBlockVersionId", "PredPostHistoryId", "PredLocalId",
+                  "RootPostBlockVersionId", "RootPostHistoryId", "RootLocalId",
+                  "PredEqual", "PredSimilarity", "PredCount", "SuccCount"),
+        newlines=("Content",),
+        skip_header=False),
+    CsvTable(
+        "PostVersionUrl",
+        ("Id", "PostId", "PostHistoryId", "PostBlockVersionId", "LinkType",
+         "LinkPosition", "LinkAnchor", "Protocol", "RootDomain",
+         "CompleteDomain", "Path", "Query", "FragmentIdentifier", "Url",
+         "FullMatch"),
+        nullable=("LinkAnchor", "Path", "Query", "FragmentIdentifier"),
+        newlines=("LinkAnchor", "FullMatch"),
+        skip_header=False),
+    CsvTable(
+        "CommentUrl",
+        ("Id", "PostId", "CommentId", "LinkType", "LinkPosition", "LinkAnchor",
+         "Protocol", "RootDomain", "CompleteDomain", "Path", "Query",
+         "FragmentIdentifier", "Url", "FullMatch"),
+        nullable=("LinkAnchor", "Path", "Query", "FragmentIdentifier"),
+        newlines=("LinkAnchor", "FullMatch"),
+        skip_header=False),
+    CsvTable(
+        "TitleVersion",
+        ("Id", "PostId", "PostTypeId", "PostHistoryId", "PostHistoryTypeId",
+         "CreationDate", "Title", "PredPostHistoryId", "PredEditDistance",
+         "SuccPostHistoryId", "SuccEditDistance"),
+        nullable=("PredPostHistoryId", "PredEditDistance",
+                  "SuccPostHistoryId", "SuccEditDistance"),
+        newlines=(),
+        skip_header=False),
+]
+postreferencegh_csv_table = CsvTable(
+    "PostReferenceGH",
+    ("FileId", "Repo", "RepoOwner", "RepoName", "Branch", "Path", "FileExt",
+     "Size", "Copies", "PostId", "CommentId", "SOUrl", "GHUrl"),
+    nullable=("CommentId",),
+    newlines=(),
+    skip_header=True)
+ghmatches_csv_table = CsvTable(
+    "GHMatches",
+    ("FileId", "PostIds", "MatchedLine"),
+    nullable=(),
+    newlines=("MatchedLine",),
+    skip_header=True)
+
+
+class CsvSource(object):
+    """Parses chunks of <table.name>.csv into insert batches"""
+
+    quoted = True
+    side_tables = ()  # tables filled along with table
+
+    def __init__(self, table, converters=(), filters=()):
+        self.spec = table
+        self.converters = converters
+        self.filters = filters
+        self.column_names = table.columns
+        self.table = table.name
+        self.file_name = "{}.csv".format(table.name)
+        self.skip_header = table.skip_header
+        self.sql_insert = "INSERT INTO {table} ({columns}) VALUES ({q_s})".format(
+            table=table.name,
+            columns=", ".join(table.columns),
+            q_s=", ".join(["?" for _ in table.columns])
+        )
+        self.nullable = [table.columns.index(column) for column in table.nullable]
+        self.newlines = [table.columns.index(column) for column in table.newlines]
+
+    def __reduce__(self):
+        return (self.__class__, (self.spec, self.converters, self.filters))
+
+    def records(self, data):
+        """Return the csv records in data passing filters as lists of column values"""
+        csv_reader = reader(StringIO(data.decode("utf-8"), newline=None),
+                            delimiter=',', quotechar='"')
+        rows = list(csv_reader)
+        if self.nullable or self.newlines:
+            nullable = self.nullable
+            newlines = self.newlines
+            for row in rows:
+                for i in newlines:
+                    row[i] = row[i].replace('&#xD;&#xA;', '\n')
+                for i in nullable:
+                    if not row[i]:
+                        row[i] = None
+        return filter_rows(rows, self.filters)
+
+    def parse(self, start, data):
+        """Return [(sql_insert, rows)] for the csv records in data"""
+        return [(self.sql_insert, coerce_rows(self.records(data), self.converters))]
+
+
+class DedupCsvSource(CsvSource):
+    """CsvSource storing one column once per distinct value (--dedup-content)
+
+    The column's values go to a content table keyed by their hash, rows of
+    the table refer to them by id.  The id is looked up by the insert itself,
+    after the chunk's new values are inserted, so chunks parse independently.
+    """
+
+    def __init__(self, table, converters=(), filters=()):
+        super(DedupCsvSource, self).__init__(table, converters, filters)
+        column, content_table = deduplicated_columns[table.name]
+        self.side_tables = (content_table,)
+        self.column = table.columns.index(column)
+        self.sql_insert_content = \
+            "INSERT OR IGNORE INTO {} (Hash, Content) VALUES (?, ?)".format(content_table)
+        self.sql_insert = "INSERT INTO {table} ({columns}) VALUES ({q_s})".format(
+            table=table.name,
+            columns=", ".join(name + "Id" if name == column else name
+                              for name in table.columns),
+            q_s=", ".join("(SELECT Id FROM {} WHERE Hash = ?)".format(content_table)
+                          if name == column else "?" for name in table.columns)
+        )
+
+    def parse(self, start, data):
+        """Return [(sql_insert_content, contents), (sql_insert, rows)] for data"""
+        rows = self.records(data)
+        i = self.column
+        # hashed before --compress, equal text compresses to equal bytes anyway
+        hashes = [blake2b(row[i].encode("utf-8"), digest_size=16).digest() for row in rows]
+        rows = [list(row) for row in coerce_rows(rows, self.converters)]
+        contents = []
+        for digest, row in zip(hashes, rows):
+            contents.append((digest, row[i]))
+            row[i] = digest
+        return [(self.sql_insert_content, contents), (self.sql_insert, rows)]
+
+
+class InternCsvSource(CsvSource):
+    """CsvSource storing columns as ids of their distinct values (--intern-urls)
+
+    Like DedupCsvSource the insert looks the ids up in the dictionary itself.
+    Values the parser already sent to the dictionary are remembered, up to
+    intern_cache_size of them, so a chunk only inserts values new to it,
+    e.g. 'https' once per parser instead of once per row.
+    """
+
+    def __init__(self, table, converters=(), filters=()):
+        super(InternCsvSource, self).__init__(table, converters, filters)
+        columns, dictionary = interned_columns[table.name]
+        self.side_tables = (dictionary,)
+        self.interned = [table.columns.index(column) for column in columns]
+        self.known = set()
+        self.sql_insert_values = \
+            "INSERT OR IGNORE INTO {} (Value) VALUES (?)".format(dictionary)
+        self.sql_insert = "INSERT INTO {table} ({columns}) VALUES ({q_s})".format(
+            table=table.name,
+            columns=", ".join(name + "Id" if name in columns else name
+                              for name in table.columns),
+            q_s=", ".join("(SELECT Id FROM {} WHERE Value = ?)".format(dictionary)
+                          if name in columns else "?" for name in table.columns)
+        )
+
+    def parse(self, start, data):
+        """Return [(sql_insert_values, values), (sql_insert, rows)] for data"""
+        rows = coerce_rows(self.records(data), self.converters)
+        known = self.known
+        values = set(row[i] for row in rows for i in self.interned).difference(known)
+        if len(known) + len(values) > intern_cache_size:
+            known.clear()
+        known.update(values)
+        return [(self.sql_insert_values, [(value,) for value in sorted(values)]),
+                (self.sql_insert, rows)]
+
+
+class JunctionCsvSource(CsvSource):
+    """CsvSource also splitting a column of delimited ids into a junction
+    table (--ghmatch-posts), e.g. a GHMatches row with PostIds '12;34' adds
+    (12, FileId) and (34, FileId) to GHMatchPost
+    """
+
+    def __init__(self, table, converters=(), filters=()):
+        super(JunctionCsvSource, self).__init__(table, converters, filters)
+        column, separator, junction_table, (id_column, key_column) = \
+            junction_columns[table.name]
+        self.side_tables = (junction_table,)
+        self.column = table.columns.index(column)
+        self.key = table.columns.index(key_column)
+        self.separator = separator
+        self.sql_insert_junction = "INSERT OR IGNORE INTO {} ({}, {}) VALUES (?, ?)".format(
+            junction_table, id_column, key_column)
+
+    def parse(self, start, data):
+        """Return [(sql_insert, rows), (sql_insert_junction, pairs)] for data"""
+        rows = self.records(data)
+        i, key, separator = self.column, self.key, self.separator
+        pairs = [(post_id, row[key]) for row in rows
+                 for post_id in split_ids(row[i], separator)]
+        # a --subset row is loaded when one of its ids is, only these are linked
+        pairs = filter_rows(pairs, [(0, ids, None) for index, ids, _ in self.filters
+                                    if index == i])
+        return [(self.sql_insert, coerce_rows(rows, self.converters)),
+                (self.sql_insert_junction, pairs)]
+
+
+def csv_source(conn, table):
+    # the --subset filters are built by load_source() if the table is loaded
+    converters = storage_converters(conn, table.name, table.columns)
+    if build_option(conn, "dedup_content") and table.name in deduplicated_columns:
+        return DedupCsvSource(table, converters, None)
+    if build_option(conn, "intern_urls") and table.name in interned_columns:
+        return InternCsvSource(table, converters, None)
+    if build_option(conn, "ghmatch_posts") and table.name in junction_columns:
+        return JunctionCsvSource(table, converters, None)
+    return CsvSource(table, converters, None)
+
+
+def load_sotorrent(conn, workers=0):
     """sqlite version of 6_load_sotorrent.sql"""
     print("6_load_sotorrent begin")
-    c = conn.cursor()
-
-    # PostBlockDiff
-    csv_filepath = os.path.join(script_dir, "PostBlockDiff.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        c.execute("PRAGMA foreign_keys = OFF;")
-        print("\tStarting PostBlockDiff at {}".format(t_start))
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostId, PostHistoryId, LocalId, PostBlockVersionId, PredPostHistoryId,
-             PredLocalId, PredPostBlockVersionId, PostBlockDiffOperationId, Text) = row
-            Text = Text.replace('&#xD;&#xA;', '\n')
-            c.execute("""
-                INSERT INTO PostBlockDiff
-                    (Id, PostId, PostHistoryId, LocalId, PostBlockVersionId, PredPostHistoryId,
-                    PredLocalId, PredPostBlockVersionId, PostBlockDiffOperationId, Text)
-                    VALUES (?,?,?,?,?,?,?,?,?,?)
-                """, (Id, PostId, PostHistoryId, LocalId, PostBlockVersionId, PredPostHistoryId,
-                      PredLocalId, PredPostBlockVersionId, PostBlockDiffOperationId, Text))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tPostBlockDiff took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-
-    # PostVersion
-    csv_filepath = os.path.join(script_dir, "PostVersion.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        c.execute("PRAGMA foreign_keys = OFF;")
-        print("\tStarting PostVersion at {}".format(t_start))
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId,
-             CreationDate, PredPostHistoryId, SuccPostHistoryId, MostRecentVersion) = row
-            if not PredPostHistoryId:
-                PredPostHistoryId = None
-            if not SuccPostHistoryId:
-                SuccPostHistoryId = None
-            c.execute("""
-                INSERT INTO PostVersion
-                    (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId,
-                    CreationDate, PredPostHistoryId, SuccPostHistoryId, MostRecentVersion)
-                    VALUES (?,?,?,?,?,?,?,?,?)
-                """, (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId,
-                      CreationDate, PredPostHistoryId, SuccPostHistoryId, MostRecentVersion))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tPostVersion took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-
-    # PostBlockVersion
-    csv_filepath = os.path.join(script_dir, "PostBlockVersion.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting PostBlockVersion at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostBlockTypeId, PostId, PostHistoryId, LocalId, PredPostBlockVersionId, PredPostHistoryId, PredLocalId, RootPostBlockVersionId,
-             RootPostHistoryId, RootLocalId, PredEqual, PredSimilarity, PredCount, SuccCount, Length, LineCount, Content, MostRecentVersion) = row
-            Content = Content.replace('&#xD;&#xA;', '\n')
-            if not PredPostBlockVersionId:
-                PredPostBlockVersionId = None
-            if not PredPostHistoryId:
-                PredPostHistoryId = None
-            if not PredLocalId:
-                PredLocalId = None
-            if not RootPostBlockVersionId:
-                RootPostBlockVersionId = None
-            if not RootPostHistoryId:
-                RootPostHistoryId = None
-            if not RootLocalId:
-                RootLocalId = None
-            if not PredEqual:
-                PredEqual = None
-            if not PredSimilarity:
-                PredSimilarity = None
-            if not PredCount:
-                PredCount = None
-            if not SuccCount:
-                SuccCount = None
-            c.execute("""
-                INSERT INTO PostBlockVersion
-                    (Id, PostBlockTypeId, PostId, PostHistoryId, LocalId, PredPostBlockVersionId, PredPostHistoryId, PredLocalId, RootPostBlockVersionId,
-                    RootPostHistoryId, RootLocalId, PredEqual, PredSimilarity, PredCount, SuccCount, Length, LineCount, Content, MostRecentVersion)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """, (Id, PostBlockTypeId, PostId, PostHistoryId, LocalId, PredPostBlockVersionId, PredPostHistoryId, PredLocalId, RootPostBlockVersionId,
-                      RootPostHistoryId, RootLocalId, PredEqual, PredSimilarity, PredCount, SuccCount, Length, LineCount, Content, MostRecentVersion))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tPostBlockVersion took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-
-    # PostVersionUrl
-    csv_filepath = os.path.join(script_dir, "PostVersionUrl.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting PostVersionUrl at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostId, PostHistoryId, PostBlockVersionId, LinkType, LinkPosition, LinkAnchor,
-             Protocol, RootDomain, CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch) = row
-            LinkAnchor = LinkAnchor.replace('&#xD;&#xA;', '\n')
-            if not LinkAnchor:
-                LinkAnchor = None
-            if not Path:
-                Path = None
-            if not Query:
-                Query = None
-            if not FragmentIdentifier:
-                FragmentIdentifier = None
-            FullMatch = FullMatch.replace('&#xD;&#xA;', '\n')
-            c.execute("""
-                INSERT INTO PostVersionUrl
-                    (Id, PostId, PostHistoryId, PostBlockVersionId, LinkType, LinkPosition, LinkAnchor,
-                     Protocol, RootDomain, CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """, (Id, PostId, PostHistoryId, PostBlockVersionId, LinkType, LinkPosition, LinkAnchor,
-                      Protocol, RootDomain, CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tPostVersionUrl took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-
-    # CommentUrl
-    csv_filepath = os.path.join(script_dir, "CommentUrl.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting CommentUrl at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostId, CommentId, LinkType, LinkPosition, LinkAnchor, Protocol, RootDomain,
-             CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch) = row
-            LinkAnchor = LinkAnchor.replace('&#xD;&#xA;', '\n')
-            if not LinkAnchor:
-                LinkAnchor = None
-            if not Path:
-                Path = None
-            if not Query:
-                Query = None
-            if not FragmentIdentifier:
-                FragmentIdentifier = None
-            FullMatch = FullMatch.replace('&#xD;&#xA;', '\n')
-            c.execute("""
-                INSERT INTO CommentUrl
-                    (Id, PostId, CommentId, LinkType, LinkPosition, LinkAnchor, Protocol, RootDomain,
-                     CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """, (Id, PostId, CommentId, LinkType, LinkPosition, LinkAnchor, Protocol, RootDomain,
-                      CompleteDomain, Path, Query, FragmentIdentifier, Url, FullMatch))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tCommentUrl took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
-
-    # TitleVersion
-    csv_filepath = os.path.join(script_dir, "TitleVersion.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting TitleVersion at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        for row in csv_reader:
-            (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId, CreationDate, Title,
-             PredPostHistoryId, PredEditDistance, SuccPostHistoryId, SuccEditDistance) = row
-            if not PredPostHistoryId:
-                PredPostHistoryId = None
-            if not PredEditDistance:
-                PredEditDistance = None
-            if not SuccPostHistoryId:
-                SuccPostHistoryId = None
-            if not SuccEditDistance:
-                SuccEditDistance = None
-            c.execute("""
-                INSERT INTO TitleVersion
-                    (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId, CreationDate, Title,
-                     PredPostHistoryId, PredEditDistance, SuccPostHistoryId, SuccEditDistance)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                """, (Id, PostId, PostTypeId, PostHistoryId, PostHistoryTypeId, CreationDate, Title,
-                      PredPostHistoryId, PredEditDistance, SuccPostHistoryId, SuccEditDistance))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tTitleVersion took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
+    for table in sotorrent_csv_tables:
+        load_source(conn, "6_load_sotorrent", csv_source(conn, table), workers)
     print("6_load_sotorrent done")
 
 
-def load_postreferencegh(conn):
+def load_postreferencegh(conn, workers=0):
     """7_load_postreferencegh.sql"""
     print("7_load_postreferencegh begin")
-    c = conn.cursor()
-
-    csv_filepath = os.path.join(script_dir, "PostReferenceGH.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting PostReferenceGH at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        skipped_one = False
-        for row in csv_reader:
-            if not skipped_one:
-                skipped_one = True
-                continue
-            (FileId, Repo, RepoOwner, RepoName, Branch, Path, FileExt, Size,
-             Copies, PostId, CommentId, SOUrl, GHUrl) = row
-            if not CommentId:
-                CommentId = None
-            c.execute("""
-                INSERT INTO PostReferenceGH
-                    (FileId, Repo, RepoOwner, RepoName, Branch, Path, FileExt, Size,
-                     Copies, PostId, CommentId, SOUrl, GHUrl)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """, (FileId, Repo, RepoOwner, RepoName, Branch, Path, FileExt, Size,
-                      Copies, PostId, CommentId, SOUrl, GHUrl))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tPostReferenceGH took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
+    load_source(conn, "7_load_postreferencegh",
+                csv_source(conn, postreferencegh_csv_table), workers)
     print("7_load_postreferencegh done")
 
 
-def load_ghmatches(conn):
+def load_ghmatches(conn, workers=0):
     """8_load_ghmatches.sql"""
     print("8_load_ghmatches begin")
-    c = conn.cursor()
-
     field_size_limit(sys.maxsize)  # GHMatches csv threw error
-
-    csv_filepath = os.path.join(script_dir, "GHMatches.csv")
-    with open(csv_filepath) as csvfile:
-        t_start = datetime.now()
-        print("\tStarting GHMatches at {}".format(t_start))
-        c.execute("PRAGMA foreign_keys = OFF;")
-        csv_reader = reader(csvfile, delimiter=',', quotechar='"')
-        counter = 0
-        commit_counter = 0
-        skipped_one = False
-        for row in csv_reader:
-            if not skipped_one:
-                skipped_one = True
-                continue
-            (FileId, PostIds, MatchedLine) = row
-            MatchedLine = MatchedLine.replace('&#xD;&#xA;', '\n')
-            c.execute("INSERT INTO GHMatches VALUES (?,?,?)",
-                      (FileId, PostIds, MatchedLine))
-            counter += 1
-            if counter % commit_block == 0:
-                conn.commit()  # must commit or all changes still in memory
-                commit_counter += 1
-                print("\r\tcommit no {}, elapsed: {}".format(
-                    commit_counter, datetime.now() - t_start), end="")
-        print("\n\tGHMatches took {} ({} rows)".format(
-            datetime.now() - t_start, counter))
-        c.execute("PRAGMA foreign_keys = ON;")
-        conn.commit()
+    load_source(conn, "8_load_ghmatches", csv_source(conn, ghmatches_csv_table), workers)
     print("8_load_ghmatches done")
 
 
@@ -818,66 +1961,1124 @@ def create_sotorrent_indicies(conn):
     """9_create_sotorrent_indices.sql"""
     print("9_create_sotorrent_indicies begin")
     c = conn.cursor()
-    c.execute("CREATE INDEX postblockdiff_index_1 ON PostBlockDiff(LocalId);")
-    c.execute("CREATE INDEX postblockdiff_index_2 ON PostBlockDiff(PredLocalId);")
+    c.execute("CREATE INDEX IF NOT EXISTS postblockdiff_index_1 ON PostBlockDiff(LocalId);")
+    c.execute("CREATE INDEX IF NOT EXISTS postblockdiff_index_2 ON PostBlockDiff(PredLocalId);")
 
-    c.execute("CREATE INDEX postblockversion_index_1 ON PostBlockVersion(LocalId);")
+    c.execute("CREATE INDEX IF NOT EXISTS postblockversion_index_1 ON PostBlockVersion(LocalId);")
     c.execute(
-        "CREATE INDEX postblockversion_index_2 ON PostBlockVersion(PredLocalId);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_2 ON PostBlockVersion(PredLocalId);")
     c.execute(
-        "CREATE INDEX postblockversion_index_3 ON PostBlockVersion(RootLocalId);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_3 ON PostBlockVersion(RootLocalId);")
     c.execute(
-        "CREATE INDEX postblockversion_index_4 ON PostBlockVersion(PredSimilarity);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_4 ON PostBlockVersion(PredSimilarity);")
     c.execute(
-        "CREATE INDEX postblockversion_index_5 ON PostBlockVersion(PredCount);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_5 ON PostBlockVersion(PredCount);")
     c.execute(
-        "CREATE INDEX postblockversion_index_6 ON PostBlockVersion(SuccCount);")
-    c.execute("CREATE INDEX postblockversion_index_7 ON PostBlockVersion(Length);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_6 ON PostBlockVersion(SuccCount);")
+    c.execute("CREATE INDEX IF NOT EXISTS postblockversion_index_7 ON PostBlockVersion(Length);")
     c.execute(
-        "CREATE INDEX postblockversion_index_8 ON PostBlockVersion(LineCount);")
+        "CREATE INDEX IF NOT EXISTS postblockversion_index_8 ON PostBlockVersion(LineCount);")
+
+    c.execute("CREATE INDEX IF NOT EXISTS commenturl_index_1 ON CommentUrl(PostId);")
+    c.execute("CREATE INDEX IF NOT EXISTS postversionurl_index_1 ON PostVersionUrl(PostId);")
+    if build_option(conn, "intern_urls"):
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS commenturl_index_2 ON CommentUrl(RootDomainId);")
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS postversionurl_index_2 ON PostVersionUrl(RootDomainId);")
+
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_1 ON PostReferenceGH(FileId);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_2 ON PostReferenceGH(RepoName);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_3 ON PostReferenceGH(Branch);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_4 ON PostReferenceGH(FileExt);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_5 ON PostReferenceGH(Size);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_6 ON PostReferenceGH(Copies);")
+    c.execute("CREATE INDEX IF NOT EXISTS postreferencegh_index_7 ON PostReferenceGH(PostId);")
+
+    c.execute("CREATE INDEX IF NOT EXISTS titleversion_index_1 ON TitleVersion(PredEditDistance);")
+    c.execute("CREATE INDEX IF NOT EXISTS titleversion_index_2 ON TitleVersion(SuccEditDistance);")
+
+    c.execute("CREATE INDEX IF NOT EXISTS ghmatches_index_1 ON GHMatches(FileId);")
+    conn.commit()
+    print("9_create_sotorrent_indicies done")
 
-    c.execute("CREATE INDEX commenturl_index_1 ON CommentUrl(PostId);")
 
-    c.execute("CREATE INDEX postreferencegh_index_1 ON PostReferenceGH(FileId);")
-    c.execute("CREATE INDEX postreferencegh_index_2 ON PostReferenceGH(RepoName);")
-    c.execute("CREATE INDEX postreferencegh_index_3 ON PostReferenceGH(Branch);")
-    c.execute("CREATE INDEX postreferencegh_index_4 ON PostReferenceGH(FileExt);")
-    c.execute("CREATE INDEX postreferencegh_index_5 ON PostReferenceGH(Size);")
-    c.execute("CREATE INDEX postreferencegh_index_6 ON PostReferenceGH(Copies);")
+loaded_tables = so_xml_tables + [table.name for table in sotorrent_csv_tables] + [
+    postreferencegh_csv_table.name, ghmatches_csv_table.name]
+
+# a --typed DATETIME column holds milliseconds since 1970, views show it in
+# the format of the table's input: 2008-07-31T21:42:52.667 in the xml dumps,
+# 2008-07-31 21:42:52 in the SOTorrent csv files
+sql_iso_datetime = ("CASE WHEN typeof({0}) = 'integer' "
+                    "THEN strftime('%Y-%m-%dT%H:%M:%f', {0} / 1000.0, 'unixepoch') "
+                    "ELSE {0} END")
+sql_csv_datetime = ("CASE WHEN typeof({0}) = 'integer' "
+                    "THEN strftime('%Y-%m-%d %H:%M:%S', {0} / 1000, 'unixepoch') || "
+                    "CASE WHEN {0} % 1000 THEN printf('.%03d', {0} % 1000) ELSE '' END "
+                    "ELSE {0} END")
+# a --typed BOOLEAN holds 0 or 1, the xml dumps write True and False
+sql_xml_boolean = "CASE {0} WHEN 1 THEN 'True' WHEN 0 THEN 'False' ELSE {0} END"
+
+
+def storage_view_sql(conn, table):
+    """Return the SELECT presenting a table stored in another form (--typed,
+    --compress, --dedup-content, --intern-urls) with its declared columns, from
+    <table>Data, or None if it is stored as is
+    """
+    typed = build_option(conn, "typed")
+    compressed = compressed_columns.get(table, ()) if build_option(conn, "compress") else ()
+    deduplicated = {}
+    if build_option(conn, "dedup_content") and table in deduplicated_columns:
+        column, content_table = deduplicated_columns[table]
+        deduplicated[column + "Id"] = (column, content_table)
+    interned = {}
+    if build_option(conn, "intern_urls") and table in interned_columns:
+        names, dictionary = interned_columns[table]
+        interned = dict((name + "Id", (name, dictionary)) for name in names)
+    columns = []
+    changed = False
+    for _, name, decl, _, _, _ in conn.execute(
+            "PRAGMA table_info({});".format(table)).fetchall():
+        if typed and decl.upper() == "DATETIME":
+            sql_datetime = sql_iso_datetime if table in so_xml_tables else sql_csv_datetime
+            columns.append("{} AS {}".format(sql_datetime.format(name), name))
+            changed = True
+        elif typed and decl.upper() in ("BOOLEAN", "TINYINT(1)") and table in so_xml_tables:
+            columns.append("{} AS {}".format(sql_xml_boolean.format(name), name))
+            changed = True
+        elif name in compressed:
+            columns.append("decompress_text({0}) AS {0}".format(name))
+            changed = True
+        elif name in deduplicated:
+            column, content_table = deduplicated[name]
+            sql_content = "(SELECT Content FROM {0} WHERE {0}.Id = {1}Data.{2})".format(
+                content_table, table, name)
+            if column in compressed:
+                sql_content = "decompress_text({})".format(sql_content)
+            columns.append("{} AS {}".format(sql_content, column))
+            changed = True
+        elif name in interned:
+            column, dictionary = interned[name]
+            columns.append("(SELECT Value FROM {0} WHERE {0}.Id = {1}Data.{2}) AS {3}".format(
+                dictionary, table, name, column))
+            changed = True
+        else:
+            columns.append(name)
+    if not changed:
+        return None
+    return "SELECT {} FROM {}Data".format(", ".join(columns), table)
+
+
+def storage_table(conn, table):
+    """Name of the table holding the rows of table, <table>Data once it is
+    behind a storage view"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?",
+                    (table,)).fetchone():
+        return table + "Data"
+    return table
+
+
+def create_storage_view(conn, table, sql_select):
+    """Rename table to <table>Data and create a view named table in its place"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (table,)).fetchone():
+        conn.execute("ALTER TABLE {0} RENAME TO {0}Data;".format(table))
+    conn.execute("CREATE VIEW IF NOT EXISTS {} AS {};".format(table, sql_select))
+    conn.commit()
 
-    c.execute("CREATE INDEX titleversion_index_1 ON TitleVersion(PredEditDistance);")
-    c.execute("CREATE INDEX titleversion_index_2 ON TitleVersion(SuccEditDistance);")
 
-    c.execute("CREATE INDEX ghmatches_index_1 ON GHMatches(FileId);")
+def create_storage_views(conn):
+    """Present the tables stored in another form with their original columns
+
+    Loading and indexing use the tables as created, only the finished
+    tables are renamed <table>Data and shadowed by views, e.g. Posts shows
+    --typed CreationDate values as 2008-07-31T21:42:52.667 while
+    PostsData.CreationDate holds 1217540572667.  Views of --compress columns
+    need register_functions() on the connection reading them.
+    """
+    print("10_create_storage_views begin")
+    for table in loaded_tables:
+        sql_select = storage_view_sql(conn, table)
+        if sql_select is not None:
+            create_storage_view(conn, table, sql_select)
+    print("10_create_storage_views done")
+
+
+# FTS5 indices built with --fts, as (name, table, column, tokenizer, condition)
+fts_indices = [
+    ("PostsFts", "Posts", "Body", "unicode61", None),
+    ("CommentsFts", "Comments", "Text", "unicode61", None),
+    ("PostBlockVersionFts", "PostBlockVersion", "Content", "unicode61", None),
+]
+# with --fts-split-code text blocks are stemmed while code blocks keep
+# identifiers like foo_bar or $x as one token
+fts_split_indices = fts_indices[:2] + [
+    ("PostBlockTextFts", "PostBlockVersion", "Content", "porter unicode61",
+     "PostBlockTypeId = 1"),
+    ("PostBlockCodeFts", "PostBlockVersion", "Content", "unicode61 tokenchars '_$'",
+     "PostBlockTypeId = 2"),
+]
+
+
+def fts_content(name, table, condition):
+    """Table an index reads its text from: table, or for an index of the rows
+    matching condition a view of just these rows (e.g. PostBlockTextContent),
+    so the index and its content agree for 'integrity-check' and 'rebuild'
+    """
+    return table if condition is None else name[:-len("Fts")] + "Content"
+
+
+def fill_fts_index(conn, step, name, table, column, condition=None):
+    """Index the column of every table row matching condition in batches
+
+    Each batch of commit_block rows is committed with the last indexed Id as
+    the progress offset, so an interrupted fill continues after it.
+    """
+    c = conn.cursor()
+    counter, last_id, done = get_progress(conn, step, name)
+    if done:
+        print("\t{} already filled ({} rows), skipping".format(name, counter))
+        return
+    t_start = datetime.now()
+    print("\tStarting {} at {}".format(name, t_start))
+    where = "Id > ? AND Id <= ?" + (" AND " + condition if condition else "")
+    # seconds spent selecting the next batch, indexing it and committing it
+    phases = {"parse": 0.0, "bind": 0.0, "commit": 0.0}
+    resumed_rows = counter
+    commit_counter = 0
+    while True:
+        t_parse = perf_counter()
+        end, count = c.execute("""
+            SELECT max(Id), count(*) FROM (
+                SELECT Id FROM {table} WHERE Id > ?{condition} ORDER BY Id LIMIT ?)
+            """.format(table=table, condition=" AND " + condition if condition else ""),
+            (last_id, commit_block)).fetchone()
+        t_bind = perf_counter()
+        phases["parse"] += t_bind - t_parse
+        if not count:
+            break
+        c.execute("INSERT INTO {name} (rowid, {column}) SELECT Id, {column} FROM {table} "
+                  "WHERE {where};".format(name=name, column=column, table=table, where=where),
+                  (last_id, end))
+        counter += count
+        last_id = end
+        set_progress(conn, step, name, counter, last_id)
+        t_commit = perf_counter()
+        conn.commit()
+        phases["bind"] += t_commit - t_bind
+        phases["commit"] += perf_counter() - t_commit
+        commit_counter += 1
+        print("\r\t{} rows, elapsed: {}".format(counter, datetime.now() - t_start), end="")
+        if metrics:
+            seconds = max(perf_counter() - t_parse, 1e-9)
+            db_bytes, journal_bytes = database_sizes(conn)
+            metrics.event(
+                "commit", step=step, table=name, commit=commit_counter, rows=counter,
+                commit_rows=count, seconds=round(seconds, 3),
+                rows_per_s=round(count / seconds, 1), parse_s=round(t_bind - t_parse, 3),
+                bind_s=round(t_commit - t_bind, 3),
+                commit_s=round(perf_counter() - t_commit, 3),
+                db_bytes=db_bytes, journal_bytes=journal_bytes, rss_bytes=process_rss())
+    set_progress(conn, step, name, counter, last_id, True)
     conn.commit()
-    print("9_create_sotorrent_indicies done")
+    print("\n\t{} took {} ({} rows)".format(name, datetime.now() - t_start, counter))
+    if metrics:
+        seconds = max((datetime.now() - t_start).total_seconds(), 1e-9)
+        db_bytes, journal_bytes = database_sizes(conn)
+        metrics.event(
+            "table", step=step, table=name, started=t_start.timestamp(), rows=counter,
+            seconds=round(seconds, 3), rows_per_s=round((counter - resumed_rows) / seconds, 1),
+            parse_s=round(phases["parse"], 3), bind_s=round(phases["bind"], 3),
+            commit_s=round(phases["commit"], 3), commits=commit_counter + 1,
+            db_bytes=db_bytes, journal_bytes=journal_bytes, rss_bytes=process_rss())
+
+
+def create_fts_indices(conn):
+    """Build FTS5 indices over the large text columns (--fts)
+
+    The indices are external content tables, they hold only the index and
+    read the text from the table (or its storage view) by Id, e.g.
+    SELECT rowid FROM PostsFts WHERE PostsFts MATCH 'sqlite3'.  With
+    --fts-optimize segments are not merged while filling, every index is
+    merged into one b-tree at the end instead.
+    """
+    print("11_create_fts_indices begin")
+    c = conn.cursor()
+    optimize = build_option(conn, "fts_optimize")
+    indices = fts_split_indices if build_option(conn, "fts_split_code") else fts_indices
+    for name, table, column, tokenizer, condition in indices:
+        content = fts_content(name, table, condition)
+        if content != table:
+            c.execute("CREATE VIEW IF NOT EXISTS {} AS SELECT Id, {} FROM {} WHERE {};".format(
+                content, column, table, condition))
+        c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+                {column}, content='{content}', content_rowid='Id', tokenize="{tokenizer}"
+            );""".format(name=name, column=column, content=content, tokenizer=tokenizer))
+        if optimize:
+            c.execute("INSERT INTO {0} ({0}, rank) VALUES ('automerge', 0);".format(name))
+        conn.commit()
+        fill_fts_index(conn, "11_create_fts_indices", name, table, column, condition)
+        if optimize:
+            t_start = datetime.now()
+            c.execute("INSERT INTO {0} ({0}) VALUES ('optimize');".format(name))
+            c.execute("INSERT INTO {0} ({0}, rank) VALUES ('automerge', 4);".format(name))
+            conn.commit()
+            print("\tOptimized {} took {}".format(name, datetime.now() - t_start))
+    print("11_create_fts_indices done")
+
+
+# blocks of a post version are joined into its markdown with this separator
+post_version_separator = "\n"
+
+
+def post_version_texts(conn, where, params):
+    """Yield (PostHistoryId, PostId, markdown) of every post version matching where
+
+    The blocks of each version are read in PostHistoryId, LocalId order
+    (postblockversion_index_9) and joined with post_version_separator.
+    """
+    for (post_history_id, post_id), blocks in groupby(conn.execute("""
+            SELECT PostHistoryId, PostId, Content FROM PostBlockVersion
+                WHERE {} ORDER BY PostHistoryId, LocalId
+            """.format(where), params), key=itemgetter(0, 1)):
+        yield post_history_id, post_id, post_version_separator.join(
+            content for _, _, content in blocks)
+
+
+def write_post_version_texts(conn, rows):
+    """Insert or replace (PostHistoryId, PostId, markdown) rows of PostVersionText"""
+    compressed = build_option(conn, "compress")
+    conn.executemany(
+        "INSERT OR REPLACE INTO {} (PostHistoryId, PostId, Content) VALUES (?, ?, ?);".format(
+            storage_table(conn, "PostVersionText")),
+        [(post_history_id, post_id, compress_text(text) if compressed else text)
+         for post_history_id, post_id, text in rows])
+
+
+def create_post_version_text(conn):
+    """Store the markdown of every post version in PostVersionText (--post-version-text)
+
+    PostVersionText is keyed by PostHistoryId, so the text of any version
+    is one b-tree lookup instead of sorting and joining its blocks, e.g.
+    SELECT Content FROM PostVersionText WHERE PostHistoryId = 1.  It is
+    filled in batches of commit_block versions with the last PostHistoryId
+    as the progress offset, --compress compresses its Content.
+    """
+    print("12_create_post_version_text begin")
+    step = "12_create_post_version_text"
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS PostVersionText (
+            PostHistoryId INTEGER PRIMARY KEY,
+            PostId INT NOT NULL,
+            Content TEXT NOT NULL
+        );""")
+    c.execute("CREATE INDEX IF NOT EXISTS postblockversion_index_9 ON {}(PostHistoryId, "
+              "LocalId);".format(storage_table(conn, "PostBlockVersion")))
+    conn.commit()
+    counter, last_id, done = get_progress(conn, step, "PostVersionText")
+    t_start = datetime.now()
+    while not done:
+        end = c.execute("""
+            SELECT max(PostHistoryId) FROM (
+                SELECT DISTINCT PostHistoryId FROM PostBlockVersion
+                    WHERE PostHistoryId > ? ORDER BY PostHistoryId LIMIT ?)
+            """, (last_id, commit_block)).fetchone()[0]
+        if end is None:
+            break
+        rows = list(post_version_texts(conn, "PostHistoryId > ? AND PostHistoryId <= ?",
+                                       (last_id, end)))
+        write_post_version_texts(conn, rows)
+        counter += len(rows)
+        last_id = end
+        set_progress(conn, step, "PostVersionText", counter, last_id)
+        conn.commit()
+        print("\r\t{} versions, elapsed: {}".format(counter, datetime.now() - t_start), end="")
+    set_progress(conn, step, "PostVersionText", counter, last_id, True)
+    conn.commit()
+    print("\n\tPostVersionText took {} ({} versions)".format(datetime.now() - t_start, counter))
+    sql_select = storage_view_sql(conn, "PostVersionText")
+    if sql_select is not None:
+        create_storage_view(conn, "PostVersionText", sql_select)
+    print("12_create_post_version_text done")
+
+
+def create_post_tags_trigger(conn):
+    """Unlink the tags of posts whose Tags --update changes, the new tags are
+    linked again by the insert into PostTags following the Posts insert
+    """
+    conn.execute("""
+        CREATE TEMP TRIGGER IF NOT EXISTS post_tags_update AFTER UPDATE OF Tags
+            ON main.{}
+        BEGIN
+            DELETE FROM PostTags WHERE PostId = old.Id;
+        END;""".format(storage_table(conn, "Posts")))
+
+
+def create_post_version_triggers(conn):
+    """Collect the PostHistoryIds of blocks changed by --update in PostVersionStale
+
+    PostVersionStale is a table of the database, so the versions to rebuild
+    are kept when an update is interrupted; the triggers are temporary.
+    """
+    target = storage_table(conn, "PostBlockVersion")
+    conn.execute("CREATE TABLE IF NOT EXISTS PostVersionStale (PostHistoryId INTEGER PRIMARY KEY);")
+    for event in ["INSERT", "UPDATE"]:
+        conn.execute("""
+            CREATE TEMP TRIGGER IF NOT EXISTS post_version_stale_{event} AFTER {event}
+                ON main.{target}
+            BEGIN
+                INSERT OR IGNORE INTO PostVersionStale VALUES (new.PostHistoryId);
+            END;""".format(event=event.lower(), target=target))
+    conn.commit()
+
+
+def refresh_post_version_text(conn):
+    """Rebuild the PostVersionText rows of the versions in PostVersionStale"""
+    c = conn.cursor()
+    counter = 0
+    while True:
+        ids = [post_history_id for (post_history_id,) in c.execute(
+            "SELECT PostHistoryId FROM PostVersionStale ORDER BY PostHistoryId LIMIT ?",
+            (commit_block,))]
+        if not ids:
+            break
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS PostVersionBatch "
+                  "(PostHistoryId INTEGER PRIMARY KEY);")
+        c.execute("DELETE FROM PostVersionBatch;")
+        c.executemany("INSERT INTO PostVersionBatch VALUES (?);", [(i,) for i in ids])
+        write_post_version_texts(conn, post_version_texts(
+            conn, "PostHistoryId IN (SELECT PostHistoryId FROM PostVersionBatch)", ()))
+        c.execute("DELETE FROM PostVersionStale WHERE PostHistoryId <= ?", (ids[-1],))
+        conn.commit()
+        counter += len(ids)
+    c.execute("DROP TABLE PostVersionStale;")
+    conn.commit()
+    print("\tRebuilt PostVersionText of {} versions".format(counter))
+
+
+fk_sample_size = 5  # missing keys printed per foreign key
+
+
+def foreign_keys(conn):
+    """Return [(table, columns, parent, parent columns), ...] of every
+    FOREIGN KEY clause, naming the tables holding the rows (e.g. PostsData)
+    """
+    relations = []
+    for (table,) in conn.execute("""
+            SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name
+            """).fetchall():
+        keys = {}
+        for key_id, _, parent, column, parent_column, _, _, _ in conn.execute(
+                "PRAGMA foreign_key_list({});".format(table)).fetchall():
+            _, columns, parent_columns = keys.setdefault(key_id, (parent, [], []))
+            columns.append(column)
+            parent_columns.append(parent_column)
+        relations += [(table, tuple(columns), parent, tuple(parent_columns))
+                      for parent, columns, parent_columns in (
+                          keys[key_id] for key_id in sorted(keys))]
+    return relations
+
+
+def orphans_sql(relation, locations, select):
+    """SELECT select of the rows whose key has no parent row, an anti-join
+    seeking every key in the parent's primary key"""
+    table, columns, parent, parent_columns = relation
+    return """
+        SELECT {select} FROM {table} AS child
+            WHERE {not_null} AND NOT EXISTS (
+                SELECT 1 FROM {parent} AS parent WHERE {match})""".format(
+        select=select,
+        table=locations.get(table, table),
+        parent=locations.get(parent, parent),
+        not_null=" AND ".join("child.{} IS NOT NULL".format(column) for column in columns),
+        match=" AND ".join("parent.{} = child.{}".format(parent_column, column)
+                           for column, parent_column in zip(columns, parent_columns)))
+
+
+def orphans_table(relation):
+    """Name of the table --write-orphans copies the orphans of relation to,
+    e.g. PostsParentIdOrphans"""
+    table, columns, _, _ = relation
+    return "{}{}Orphans".format(re.sub(r"Data\Z", "", table), "".join(columns))
+
+
+def open_verify_connection(db_path, shards):
+    """Connection to db_path with the kept shards attached, and {table:
+    qualified name} of the tables found in a shard"""
+    conn = connect(db_path)
+    locations = {}
+    if shards:
+        attach_shards(conn)
+        for _, alias, _ in conn.execute("PRAGMA database_list;").fetchall():
+            if alias in ("main", "temp"):
+                continue
+            for (name,) in conn.execute(
+                    "SELECT name FROM {}.sqlite_master WHERE type = 'table'".format(alias)):
+                locations.setdefault(name, "{}.{}".format(alias, name))
+    return conn, locations
+
+
+def _verify_worker(db_path, shards, relations, results):
+    """Thread checking relations from a queue on a connection of its own"""
+    relation = None
+    try:
+        conn, locations = open_verify_connection(db_path, shards)
+        while True:
+            try:
+                relation = relations.get_nowait()
+            except Empty:
+                break
+            t_start = time()
+            orphans = 0
+            sample = []
+            for row in conn.execute(orphans_sql(relation, locations, ", ".join(
+                    "child." + column for column in relation[1]))):
+                orphans += 1
+                if len(sample) < fk_sample_size:
+                    sample.append(row[0] if len(row) == 1 else list(row))
+            results.put((relation, orphans, sample, time() - t_start))
+        conn.close()
+    except Exception:
+        results.put((relation, None, format_exc(), 0))
+
+
+def verify_foreign_keys(conn, workers=0, write_orphans=False):
+    """Find the rows breaking a FOREIGN KEY of the loaded database
+
+    Tables are loaded with foreign_keys OFF, so nothing checks them while
+    loading.  Every relation is checked as a whole by one anti-join, a scan
+    of the table seeking each key in the parent's primary key, and the
+    relations are spread over max(1, workers) threads reading through
+    connections of their own.  The orphans of each relation are counted and
+    a sample of their keys printed, with write_orphans the orphan rows are
+    copied to <table><columns>Orphans.  Orphans do not fail the build, the
+    dumps refer to deleted posts and users.
+    """
+    print("13_verify_foreign_keys begin")
+    db_path = conn.execute("PRAGMA database_list;").fetchone()[2]
+    # shards of a --shards build are merged and removed, --keep-shards keeps them
+    shards = [shard_name for (shard_name,) in conn.execute(
+        "SELECT DISTINCT Value FROM Metadata WHERE Key LIKE 'shard:%'").fetchall()
+        if os.path.exists(os.path.join(os.path.dirname(db_path), shard_name))]
+    relations = foreign_keys(conn)
+    queue = LocalQueue()
+    for relation in relations:
+        queue.put(relation)
+    results = LocalQueue()
+    for _ in range(max(1, workers)):
+        Thread(target=_verify_worker, args=(db_path, shards, queue, results),
+               daemon=True).start()
+    orphaned = []
+    for _ in relations:
+        relation, orphans, sample, seconds = results.get()
+        if orphans is None:
+            raise RuntimeError("checking {} failed:\n{}".format(relation, sample))
+        table, columns, parent, parent_columns = relation
+        print("\tChecked {}({}) -> {}({}) took {} ({} orphans{})".format(
+            table, ", ".join(columns), parent, ", ".join(parent_columns),
+            timedelta(seconds=round(seconds)), orphans,
+            ", e.g. {}".format(sample) if sample else ""))
+        if metrics:
+            metrics.event("foreign_key", table=table, columns=columns, parent=parent,
+                          orphans=orphans, sample=sample, seconds=round(seconds, 3))
+        if orphans:
+            orphaned.append(relation)
+    if write_orphans:
+        writer, locations = open_verify_connection(db_path, shards)
+        for relation in relations:
+            writer.execute("DROP TABLE IF EXISTS main.{};".format(orphans_table(relation)))
+        for relation in orphaned:
+            writer.execute("CREATE TABLE main.{} AS {};".format(
+                orphans_table(relation), orphans_sql(relation, locations, "child.*")))
+            print("\tWrote {}".format(orphans_table(relation)))
+        writer.commit()
+        writer.close()
+    print("\t{} of {} foreign keys have orphans".format(len(orphaned), len(relations)))
+    print("13_verify_foreign_keys done")
+
+
+def build_sources(conn):
+    """Return [(step, source), ...] for every table loaded from an input file"""
+    sources = [("2_load_so_from_xml", xml_source(conn, table))
+               for table in so_xml_tables]
+    sources += [("6_load_sotorrent", csv_source(conn, table))
+                for table in sotorrent_csv_tables]
+    sources.append(("7_load_postreferencegh", csv_source(conn, postreferencegh_csv_table)))
+    sources.append(("8_load_ghmatches", csv_source(conn, ghmatches_csv_table)))
+    return sources
+
+
+def shard_file(i):
+    root, ext = os.path.splitext(db_file)
+    return "{}.shard{}{}".format(root, i, ext)
+
+
+def assign_shards(conn, sources, shards):
+    """Return {shard file: [(step, source), ...]} balancing input bytes
+
+    Tables are handed to the least loaded shard, largest input first.  The
+    assignment is recorded in Metadata ("shard:<table>"), so a resumed build
+    and attach_shards() find every table again.
+    """
+    load = dict((shard_file(i), 0) for i in range(shards))
+    groups = {}
+    for step, source in sorted(sources, key=lambda s: -os.path.getsize(input_path(s[1].file_name))):
+        size = os.path.getsize(input_path(source.file_name))
+        shard_name = get_metadata(conn, "shard:{}".format(source.table))
+        if shard_name is None:
+            filepath = min(load, key=lambda f: (load[f], f))
+            set_metadata(conn, [("shard:{}".format(table), os.path.basename(filepath))
+                                for table in (source.table,) + source.side_tables])
+        else:
+            filepath = os.path.join(os.path.dirname(db_file), shard_name)
+        load[filepath] = load.get(filepath, 0) + size
+        groups.setdefault(filepath, []).append((step, source))
+    return groups
+
+
+def _load_shard(filepath, tasks, profile, workers, csv_field_size_limit, commit_limits,
+                metrics_run, results):
+    """Process loading [(step, source, sql_creates), ...] into one shard file"""
+    global metrics, commit_bytes_limits, commit_seconds, slow_commit_fraction
+    field_size_limit(csv_field_size_limit)
+    commit_bytes_limits, commit_seconds, slow_commit_fraction = commit_limits
+    if metrics_run:
+        metrics = MetricsLog(*metrics_run)
+    # interleaved progress lines of concurrent shards are unreadable
+    sys.stdout = open(os.path.splitext(filepath)[0] + ".log", "a", buffering=1)
+    try:
+        conn = connect(filepath)
+        apply_pragmas(conn, build_profiles[profile])
+        create_progress_table(conn)
+        for step, source, sql_creates in tasks:
+            for sql_create in sql_creates:
+                conn.execute(sql_create.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+            load_source(conn, step, source, workers)
+            results.put((filepath, source.table, get_progress(conn, step, source.table)[0]))
+        conn.close()
+        results.put((filepath, None, None))
+    except Exception:
+        results.put((filepath, None, format_exc()))
+
+
+def merge_shard(conn, filepath, tasks, rows):
+    """Copy the tables of a finished shard into the database, then remove it"""
+    c = conn.cursor()
+    c.execute("PRAGMA foreign_keys = OFF;")
+    c.execute("ATTACH DATABASE ? AS shard;", (filepath,))
+    for step, source, _ in tasks:
+        t_start = datetime.now()
+        # same schema on both sides, sqlite copies the table b-tree directly
+        for table in source.side_tables + (source.table,):
+            c.execute("INSERT INTO main.{0} SELECT * FROM shard.{0};".format(table))
+        set_progress(conn, step, source.table, rows[source.table], 0, True)
+        conn.commit()
+        print("\tMerged {} took {} ({} rows)".format(
+            source.table, datetime.now() - t_start, rows[source.table]))
+    c.execute("DETACH DATABASE shard;")
+    c.execute("PRAGMA foreign_keys = ON;")
+    os.remove(filepath)
+
+
+def index_shard(conn, filepath, tasks, rows):
+    """Create the database's indices of each table inside its kept shard"""
+    shard = connect(filepath)
+    for step, source, _ in tasks:
+        t_start = datetime.now()
+        for (sql_index,) in conn.execute("""
+                SELECT sql FROM sqlite_master
+                    WHERE type = 'index' AND tbl_name IN ({}) AND sql IS NOT NULL
+                """.format(", ".join("?" for _ in (source.table,) + source.side_tables)),
+                (source.table,) + source.side_tables).fetchall():
+            shard.execute(sql_index.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        shard.commit()
+        set_progress(conn, step, source.table, rows[source.table], 0, True)
+        conn.commit()
+        print("\tIndexed shard {} took {} ({} rows)".format(
+            source.table, datetime.now() - t_start, rows[source.table]))
+        sql_select = storage_view_sql(conn, source.table)
+        if sql_select is not None:
+            create_storage_view(shard, source.table, sql_select)
+    shard.execute("PRAGMA analysis_limit = 1000;")
+    shard.execute("ANALYZE;")
+    shard.close()
+
+
+def load_sharded(conn, shards, profile, workers=0, keep_shards=False):
+    """Load all input tables concurrently, one process per shard file
+
+    Every shard process loads its tables into a database file of its own
+    (sotorrent.shard<i>.sqlite3), so loads are not serialized on the single
+    sqlite writer.  A finished shard is merged into the database, or with
+    keep_shards indexed in place and read through attach_shards().
+    Progress of every shard goes to its .log file.
+    """
+    print("load_sharded begin")
+    sources = [(step, source) for step, source in build_sources(conn)
+               if not get_progress(conn, step, source.table)[2]]
+    groups = assign_shards(conn, sources, shards)
+    field_size_limit(sys.maxsize)  # GHMatches csv threw error
+    results = Queue()
+    procs = {}
+    tasks = {}
+    rows = {}
+    for filepath, group in sorted(groups.items()):
+        tasks[filepath] = [(step, source, [conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,)).fetchone()[0] for table in (source.table,) + source.side_tables])
+            for step, source in group]
+        procs[filepath] = Process(target=_load_shard, args=(
+            filepath, tasks[filepath], profile, workers, field_size_limit(),
+            (commit_bytes_limits, commit_seconds, slow_commit_fraction),
+            metrics and (metrics.filepath, metrics.run), results))
+        procs[filepath].start()
+        print("\tStarted {} for {}".format(
+            os.path.basename(filepath), ", ".join(source.table for _, source in group)))
+    try:
+        while procs:
+            try:
+                filepath, table, result = results.get(timeout=1)
+            except Empty:
+                if any(proc.exitcode for proc in procs.values()):
+                    raise RuntimeError("a shard process died")
+                continue
+            if table is not None:
+                rows[table] = result
+                print("\tLoaded {} into {} ({} rows)".format(
+                    table, os.path.basename(filepath), result))
+                continue
+            if result is not None:
+                raise RuntimeError("loading {} failed:\n{}".format(filepath, result))
+            procs.pop(filepath).join()
+            if keep_shards:
+                continue  # indexed once the database has its indices
+            merge_shard(conn, filepath, tasks[filepath], rows)
+    finally:
+        for proc in procs.values():
+            if proc.is_alive():
+                proc.terminate()
+    if keep_shards:
+        run_step(conn, "3_create_indices", create_indicies)
+        run_step(conn, "9_create_sotorrent_indicies", create_sotorrent_indicies)
+        for filepath in sorted(tasks):
+            index_shard(conn, filepath, tasks[filepath], rows)
+    for step in ["2_load_so_from_xml", "6_load_sotorrent",
+                 "7_load_postreferencegh", "8_load_ghmatches"]:
+        set_progress(conn, step, done=True)
+    conn.commit()
+    print("load_sharded done")
+
+
+def attach_shards(conn):
+    """Make tables kept in shard files (--keep-shards) readable through conn
+
+    Each shard is attached and a temporary view named after every table it
+    holds shadows the empty table of the same name in the main database.
+    """
+    db_dir = os.path.dirname(conn.execute("PRAGMA database_list;").fetchone()[2])
+    rows = conn.execute("SELECT Key, Value FROM Metadata WHERE Key LIKE 'shard:%'").fetchall()
+    aliases = {}
+    for key, shard_name in sorted(rows):
+        filepath = os.path.join(db_dir, shard_name)
+        if filepath not in aliases:
+            aliases[filepath] = "shard{}".format(len(aliases))
+            conn.execute("ATTACH DATABASE ? AS {};".format(aliases[filepath]), (filepath,))
+        table = key.split(":", 1)[1]
+        conn.execute("CREATE TEMP VIEW IF NOT EXISTS {0} AS SELECT * FROM {1}.{0};".format(
+            table, aliases[filepath]))
+
+
+# How --update merges the rows of a newer release into a table: rows of
+# changing tables are updated where any column differs, keyless tables
+# (no Id in their input) are reloaded and the other tables only get the
+# rows of new Ids.  Rows missing from the newer release are kept.
+update_changing_tables = ["Users", "Posts", "Comments", "Tags",
+                          "PostVersion", "PostBlockVersion", "TitleVersion"]
+update_keyless_tables = ["PostReferenceGH", "GHMatches"]
+_sql_insert = re.compile(r"INSERT INTO (\w+) \((.*?)\) VALUES (.*)\Z", re.S)
+
+
+def update_sql(conn, sql_insert):
+    """Rewrite a source's INSERT statement to merge rows into a loaded table"""
+    match = _sql_insert.match(sql_insert)
+    if match is None:
+        return sql_insert  # e.g. INSERT OR IGNORE of --dedup-content
+    table, columns, values = match.groups()
+    sql_insert = "INSERT INTO {} ({}) VALUES {}".format(
+        storage_table(conn, table), columns, values)
+    if table in update_keyless_tables:
+        return sql_insert
+    if table not in update_changing_tables:
+        return sql_insert + " ON CONFLICT(Id) DO NOTHING"
+    names = [name.strip() for name in columns.split(",") if name.strip() != "Id"]
+    return "{} ON CONFLICT(Id) DO UPDATE SET {} WHERE ({}) IS NOT ({})".format(
+        sql_insert,
+        ", ".join("{0} = excluded.{0}".format(name) for name in names),
+        ", ".join(names),
+        ", ".join("excluded." + name for name in names))
+
+
+def create_fts_triggers(conn):
+    """Keep the --fts indices in step with rows changed by --update
+
+    The triggers are temporary, they only exist for the updating connection.
+    Old text is removed through the table's view before a row changes.
+    """
+    for name, table, column, _, condition in fts_indices + fts_split_indices:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone():
+            continue
+        target = storage_table(conn, table)
+        condition = " AND " + condition if condition else ""
+        conn.execute("""
+            CREATE TEMP TRIGGER IF NOT EXISTS {name}_delete BEFORE UPDATE ON main.{target}
+            BEGIN
+                INSERT INTO {name} ({name}, rowid, {column})
+                    SELECT 'delete', Id, {column} FROM {table} WHERE Id = old.Id{condition};
+            END;""".format(name=name, target=target, table=table, column=column,
+                           condition=condition))
+        for event in ["INSERT", "UPDATE"]:
+            conn.execute("""
+                CREATE TEMP TRIGGER IF NOT EXISTS {name}_{event} AFTER {event} ON main.{target}
+                BEGIN
+                    INSERT INTO {name} (rowid, {column})
+                        SELECT Id, {column} FROM {table} WHERE Id = new.Id{condition};
+                END;""".format(name=name, event=event.lower(), target=target, table=table,
+                               column=column, condition=condition))
+
+
+def update_release(conn, step, workers=0):
+    """Merge the input files of a newer release into the loaded database
+
+    Every table is read in full, as in the build, but only rows that are
+    new or changed are written, so indices only change where rows do.  A
+    keyless table is emptied before it is loaded again.
+    """
+    print("{} begin".format(step))
+    field_size_limit(sys.maxsize)  # GHMatches csv threw error
+    create_fts_triggers(conn)
+    post_version_text = build_option(conn, "post_version_text")
+    if post_version_text:
+        create_post_version_triggers(conn)
+    if build_option(conn, "post_tags"):
+        create_post_tags_trigger(conn)
+    for _, source in build_sources(conn):
+        rows, offset, done = get_progress(conn, step, source.table)
+        if source.table in update_keyless_tables and not done and not offset:
+            table = storage_table(conn, source.table)
+            conn.execute("DELETE FROM {};".format(table))
+            for side_table in source.side_tables:
+                conn.execute("DELETE FROM {};".format(side_table))
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+                # Ids of the reloaded rows start at 1 again, as in a new build
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            conn.commit()
+        load_source(conn, step, source, workers, update=True)
+    if post_version_text:
+        refresh_post_version_text(conn)
+    print("{} done".format(step))
+
+
+def apply_pragmas(conn, pragmas):
+    c = conn.cursor()
+    for pragma in pragmas:
+        c.execute(pragma)
+        c.fetchall()
+
+
+def set_metadata(conn, values):
+    """Record (Key, Value) pairs describing the build in the Metadata table"""
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Metadata (
+            Key VARCHAR(64) NOT NULL,
+            Value TEXT,
+            PRIMARY KEY(Key)
+        );""")
+    c.executemany("INSERT OR REPLACE INTO Metadata VALUES (?, ?);",
+                  [(key, str(value)) for key, value in values])
+    conn.commit()
+
+
+def get_metadata(conn, key):
+    try:
+        row = conn.execute("SELECT Value FROM Metadata WHERE Key = ?",
+                           (key,)).fetchone()
+    except Error:
+        return None  # no Metadata table yet
+    return None if row is None else row[0]
+
+
+def build_option(conn, name):
+    """Whether the database is built with the storage option name (e.g. typed)"""
+    return get_metadata(conn, name) == "1"
+
+
+# options changing how tables are stored, fixed when a build starts
+storage_options = ["typed", "compact_schema", "compress", "dedup_content",
+                   "fts", "fts_split_code", "fts_optimize", "post_version_text",
+                   "ghmatch_posts", "post_tags", "intern_urls"]
+
+
+def finish_build_profile(conn):
+    """Switch from the build profile to durable read settings"""
+    print("finish_build_profile begin")
+    apply_pragmas(conn, read_profile)
+    print("finish_build_profile done")
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Load SOTorrent into {}".format(db_file_name))
+    parser.add_argument(
+        "--workers", type=int, default=0, metavar="N",
+        help="parse inputs in N worker processes feeding the sqlite writer "
+             "(default: parse in the writer process)")
+    parser.add_argument(
+        "--profile", choices=sorted(build_profiles), default="default",
+        help="PRAGMA profile used while loading: 'bulk' turns off the rollback "
+             "journal and fsyncs, 'bulk-wal' keeps a write-ahead log, both use "
+             "a 1 GiB page cache, in memory temp storage, exclusive locking and "
+             "mmap (default: sqlite defaults)")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue an interrupted build of {} from its last commit".format(
+            db_file_name))
+    parser.add_argument(
+        "--shards", type=int, default=0, metavar="N",
+        help="load the tables concurrently into N shard databases and merge "
+             "them at the end (at most 9 with --keep-shards, sqlite attaches "
+             "10 databases at a time)")
+    parser.add_argument(
+        "--keep-shards", action="store_true",
+        help="with --shards, index the shards in place instead of merging them, "
+             "read them through attach_shards()")
+    parser.add_argument(
+        "--typed", action="store_true",
+        help="store INT, DOUBLE and BOOLEAN values as numbers and DATETIME "
+             "values as milliseconds since 1970, behind views showing the "
+             "dates as text")
+    parser.add_argument(
+        "--compact-schema", action="store_true",
+        help="declare the Id primary keys INTEGER so they alias the rowid, "
+             "without AUTOINCREMENT, and store the type tables WITHOUT ROWID")
+    parser.add_argument(
+        "--compress", action="store_true",
+        help="store Posts.Body, PostHistory.Text, PostBlockVersion.Content, "
+             "PostBlockDiff.Text and GHMatches.MatchedLine zlib compressed, "
+             "behind views decompressing them with register_functions()")
+    parser.add_argument(
+        "--dedup-content", action="store_true",
+        help="store every distinct PostBlockVersion.Content once in "
+             "PostBlockContent, behind a view of PostBlockVersion")
+    parser.add_argument(
+        "--post-tags", action="store_true",
+        help="link every post to the Tags.Id of its tags while loading Posts, "
+             "in PostTags(TagId, PostId) clustered by tag")
+    parser.add_argument(
+        "--intern-urls", action="store_true",
+        help="store Protocol, RootDomain and CompleteDomain of PostVersionUrl "
+             "and CommentUrl as ids of the distinct values in PostVersionUrlPart "
+             "and CommentUrlPart, behind views of the url tables")
+    parser.add_argument(
+        "--ghmatch-posts", action="store_true",
+        help="split GHMatches.PostIds while loading into GHMatchPost(PostId, "
+             "FileId), clustered on PostId, so the GitHub files of a post are "
+             "an index seek")
+    parser.add_argument(
+        "--fts", action="store_true",
+        help="build FTS5 full text indices of Posts.Body, Comments.Text and "
+             "PostBlockVersion.Content once loaded")
+    parser.add_argument(
+        "--fts-split-code", action="store_true",
+        help="with --fts, index text and code blocks of PostBlockVersion "
+             "separately, stemming text and keeping identifiers whole in code")
+    parser.add_argument(
+        "--fts-optimize", action="store_true",
+        help="with --fts, merge each index into a single segment at the end "
+             "instead of while filling it")
+    parser.add_argument(
+        "--post-version-text", action="store_true",
+        help="store the markdown of every post version, its PostBlockVersion "
+             "blocks joined, in PostVersionText keyed by PostHistoryId")
+    parser.add_argument(
+        "--verify-foreign-keys", action="store_true",
+        help="check every FOREIGN KEY once the database is built, one anti-join "
+             "per relation spread over the --workers, printing the orphan rows "
+             "found")
+    parser.add_argument(
+        "--write-orphans", action="store_true",
+        help="with --verify-foreign-keys, copy the orphan rows of each relation "
+             "to a table <table><column>Orphans, e.g. PostsParentIdOrphans")
+    parser.add_argument(
+        "--release", metavar="NAME",
+        help="name of the SOTorrent release loaded, e.g. sotorrent18_12, "
+             "recorded in the Metadata table")
+    parser.add_argument(
+        "--update", action="store_true",
+        help="merge the input files of a newer --release into the existing "
+             "{}, writing only new and changed rows".format(db_file_name))
+    parser.add_argument(
+        "--subset-tag", action="append", metavar="TAG",
+        help="only load questions tagged TAG (repeatable, any of them), their "
+             "answers and every row referring to them")
+    parser.add_argument(
+        "--subset-year", metavar="YEAR",
+        help="only load posts created in YEAR, their answers and every row "
+             "referring to them")
+    parser.add_argument(
+        "--subset-ids", metavar="FIRST:LAST",
+        help="only load posts with an Id from FIRST to LAST, their answers "
+             "and every row referring to them")
+    parser.add_argument(
+        "--commit-mb", metavar="MIN:MAX", default="{}:{}".format(
+            commit_bytes_limits[0] >> 20, commit_bytes_limits[1] >> 20),
+        help="size every load transaction between MIN and MAX MiB of input, "
+             "adapted per table to the best throughput, warning when MAX is "
+             "above half the page cache (default: %(default)s, MIN:MIN for a "
+             "fixed size)")
+    parser.add_argument(
+        "--commit-seconds", type=float, default=commit_seconds, metavar="N",
+        help="commit a load transaction at the latest after N seconds "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "--slow-commit-fraction", type=float, default=slow_commit_fraction, metavar="F",
+        help="warn about a load commit, and with --metrics log a slow_commit "
+             "event, when its rows/s fall below F times the average of the "
+             "table's earlier commits (default: %(default)s, 0 to turn off)")
+    parser.add_argument(
+        "--metrics", metavar="FILE",
+        help="append json lines events of every step, commit and table to FILE "
+             "(rows, input bytes, rows/s, parse, bind and commit seconds, "
+             "database and journal size, RSS) and a summary at the end")
+    parser.add_argument(
+        "--verify-xml", nargs="+", metavar="FILE",
+        help="only check that the xml row scanner reads FILE (.xml or .xml.gz) "
+             "exactly like ElementTree's iterparse")
+    args = parser.parse_args(argv)
+    if args.keep_shards and not 0 < args.shards < 10:
+        parser.error("--keep-shards needs --shards between 1 and 9")
+    if args.keep_shards and (args.fts or args.post_version_text):
+        parser.error("--fts and --post-version-text read the merged tables, they cannot "
+                     "be used with --keep-shards")
+    if args.update and not args.release:
+        parser.error("--update needs the --release it loads")
+    if args.update and args.shards:
+        parser.error("--update cannot be used with --shards")
+    if args.update and args.profile == "bulk":
+        parser.error("--update changes a finished database, it needs the journal "
+                     "--profile bulk turns off")
+    subset = args.subset_tag or args.subset_year or args.subset_ids
+    if subset and (args.shards or args.update):
+        parser.error("--subset-* options cannot be used with --shards or --update, "
+                     "the subset is taken from the loaded Posts")
+    if args.subset_ids and not re.match(r"\d+:\d+\Z", args.subset_ids):
+        parser.error("--subset-ids needs FIRST:LAST, e.g. 1:100000")
+    if not re.match(r"\d+:\d+\Z", args.commit_mb) or \
+            int(args.commit_mb.split(":")[0]) > int(args.commit_mb.split(":")[1]):
+        parser.error("--commit-mb needs MIN:MAX with MIN <= MAX, e.g. 4:256")
+    if args.write_orphans and not args.verify_foreign_keys:
+        parser.error("--write-orphans needs --verify-foreign-keys")
+    if (args.fts_split_code or args.fts_optimize) and not args.fts:
+        parser.error("--fts-split-code and --fts-optimize need --fts")
+    return args
 
 
 def main():
+    global metrics, commit_bytes_limits, commit_seconds, slow_commit_fraction
+    args = parse_args()
+    commit_bytes_limits = tuple(int(mb) << 20 for mb in args.commit_mb.split(":"))
+    commit_seconds = args.commit_seconds
+    slow_commit_fraction = args.slow_commit_fraction
+    if args.verify_xml:
+        mismatches = sum(verify_xml_scanner(filepath) for filepath in args.verify_xml)
+        sys.exit(1 if mismatches else 0)
+    if os.path.exists(db_file) and not (args.resume or args.update):
+        print("{} already exists, remove it or pass --resume".format(db_file))
+        return
+    if args.update and not os.path.exists(db_file):
+        print("{} does not exist, build it before updating it".format(db_file))
+        return
+    conn = None
     try:
         conn = connect(db_file)
+        register_functions(conn)
+        if args.resume and get_metadata(conn, "build_profile") == "bulk":
+            # without a rollback journal an interrupted transaction is
+            # left half written, there is no consistent commit to resume
+            print("{} was built without a journal (--profile bulk), "
+                  "it cannot be resumed".format(db_file))
+            return
+        if args.update and not get_progress(conn, "10_create_storage_views")[2]:
+            print("{} is not completely built, finish it with --resume "
+                  "before updating it".format(db_file))
+            return
+        apply_pragmas(conn, build_profiles[args.profile])
+        create_progress_table(conn)
+        set_metadata(conn, [("build_profile", args.profile)])
+        # a resumed build keeps the storage options it was started with
+        set_metadata(conn, [(name, int(getattr(args, name))) for name in storage_options
+                            if get_metadata(conn, name) is None])
+        set_metadata(conn, [(key, value or "") for key, value in [
+            ("subset_tags", ",".join(args.subset_tag or [])),
+            ("subset_year", args.subset_year),
+            ("subset_ids", args.subset_ids)] if get_metadata(conn, key) is None])
 
         sc_start = datetime.now()
         print("Started {}".format(sc_start))
-
-        create_database(conn)            # 1_create_database
-        load_so_from_xml(conn)           # 2_load_so_from_xml
-        create_indicies(conn)            # 3_create_indices
-        create_sotorrent_tables(conn)    # 4_create_sotorrent_tables
-        # unnecessary                    # 5_create_sotorrent_user
-        load_sotorrent(conn)             # 6_load_sotorrent
-        load_postreferencegh(conn)       # 7_load_postreferencegh
-        load_ghmatches(conn)             # 8_load_ghmatches
-        create_sotorrent_indicies(conn)  # 9_create_sotorrent_indicies
+        if args.metrics:
+            metrics = MetricsLog(args.metrics)
+            metrics.event("build_start", argv=sys.argv[1:], db_file=db_file)
+
+        if args.update:
+            step = "update_{}".format(args.release)
+            run_step(conn, step, update_release, step, args.workers)
+        else:
+            if args.shards:
+                run_step(conn, "1_create_database", create_database)
+                run_step(conn, "4_create_sotorrent_tables", create_sotorrent_tables)
+                load_sharded(conn, args.shards, args.profile, args.workers, args.keep_shards)
+                run_step(conn, "3_create_indices", create_indicies)
+                run_step(conn, "9_create_sotorrent_indicies", create_sotorrent_indicies)
+            else:
+                run_step(conn, "1_create_database", create_database)
+                run_step(conn, "2_load_so_from_xml", load_so_from_xml, args.workers)
+                run_step(conn, "3_create_indices", create_indicies)
+                run_step(conn, "4_create_sotorrent_tables", create_sotorrent_tables)
+                # unnecessary: 5_create_sotorrent_user
+                run_step(conn, "6_load_sotorrent", load_sotorrent, args.workers)
+                run_step(conn, "7_load_postreferencegh", load_postreferencegh, args.workers)
+                run_step(conn, "8_load_ghmatches", load_ghmatches, args.workers)
+                run_step(conn, "9_create_sotorrent_indicies", create_sotorrent_indicies)
+            run_step(conn, "10_create_storage_views", create_storage_views)
+            if build_option(conn, "fts"):
+                run_step(conn, "11_create_fts_indices", create_fts_indices)
+            if build_option(conn, "post_version_text"):
+                run_step(conn, "12_create_post_version_text", create_post_version_text)
+        if args.release:
+            set_metadata(conn, [("release", args.release)])
+        finish_build_profile(conn)
+        if args.verify_foreign_keys:
+            # after the build profile, its exclusive lock keeps out other connections
+            step = "update_{}_verify_foreign_keys".format(args.release) if args.update \
+                else "13_verify_foreign_keys"
+            run_step(conn, step, verify_foreign_keys, args.workers, args.write_orphans)
 
         sc_end = datetime.now()
         print("Ended {}".format(sc_end))
         print("Elapsed: {}".format(sc_end - sc_start))
+        if metrics:
+            metrics.event("build_done", seconds=round((sc_end - sc_start).total_seconds(), 3))
+            metrics.summary()
 
     except Error as e:
         print(e)
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+        if metrics:
+            metrics.close()
 
 
 if __name__ == "__main__":
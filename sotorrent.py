@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from queue import Empty, LifoQueue
+from sqlite3 import connect
+from threading import Lock
+from urllib.request import pathname2url
+
+import main
+
+mmap_size = 1 << 36  # bytes of the database file each connection maps, 64 GiB
+cached_statements = 256  # prepared statements kept by each connection
+lookup_cache_size = 4096  # results kept by each LRU cached lookup
+
+# one field per column, dates are text as in the input whatever the storage options
+Post = namedtuple("Post", [
+    "Id", "PostTypeId", "AcceptedAnswerId", "ParentId", "CreationDate", "DeletionDate",
+    "Score", "ViewCount", "Body", "OwnerUserId", "OwnerDisplayName", "LastEditorUserId",
+    "LastEditorDisplayName", "LastEditDate", "LastActivityDate", "Title", "Tags",
+    "AnswerCount", "CommentCount", "FavoriteCount", "ClosedDate", "CommunityOwnedDate"])
+PostHistory = namedtuple("PostHistory", [
+    "Id", "PostHistoryTypeId", "PostId", "RevisionGUID", "CreationDate", "UserId",
+    "UserDisplayName", "Comment", "Text"])
+tables = dict((table.name, table) for table in main.sotorrent_csv_tables)
+PostVersionUrl = namedtuple("PostVersionUrl", tables["PostVersionUrl"].columns)
+CommentUrl = namedtuple("CommentUrl", tables["CommentUrl"].columns)
+PostReferenceGH = namedtuple("PostReferenceGH", ("Id",) + main.postreferencegh_csv_table.columns)
+GHMatch = namedtuple("GHMatch", main.ghmatches_csv_table.columns)
+# the column of GHMatches listing the Posts of a line, as GHMatchPost is filled
+ghmatch_posts_column, ghmatch_posts_separator = main.junction_columns["GHMatches"][:2]
+
+
+def select_sql(row_type, table, where):
+    return "SELECT {} FROM {} WHERE {};".format(", ".join(row_type._fields), table, where)
+
+
+sql_post = select_sql(Post, "Posts", "Id = ?")
+sql_answers = select_sql(Post, "Posts", "ParentId = ? ORDER BY Id")
+sql_post_history = select_sql(PostHistory, "PostHistory", "PostId = ? ORDER BY Id")
+sql_post_urls = select_sql(PostVersionUrl, "PostVersionUrl", "PostId = ? ORDER BY Id")
+sql_comment_urls = select_sql(CommentUrl, "CommentUrl", "PostId = ? ORDER BY Id")
+sql_github_references = select_sql(PostReferenceGH, "PostReferenceGH", "PostId = ? ORDER BY Id")
+sql_tagged_posts = select_sql(Post, "Posts", """Id IN (
+    SELECT PostId FROM PostTags WHERE TagId = (SELECT Id FROM Tags WHERE TagName = ?))
+    ORDER BY Id""")
+sql_github_matches = select_sql(
+    GHMatch, "GHMatches", "FileId IN (SELECT FileId FROM GHMatchPost WHERE PostId = ?)")
+sql_post_version_text = "SELECT Content FROM PostVersionText WHERE PostHistoryId = ?;"
+
+
+class ReadPool(object):
+    """Thread-safe pool of read-only connections to a built database
+
+    Connections are opened on demand, at most size of them, as mode=ro URIs
+    with mmap enabled, the SQL functions of main.register_functions() and the
+    shards of a --keep-shards build attached.  Each connection keeps its
+    prepared statements (cached_statements), the lookups below only use
+    constant SQL so a lookup does not prepare one again.
+
+    The lookups of several rows are generators holding a connection until
+    they are exhausted or closed.  post() and post_with_answers() keep their
+    last lookup_cache_size results, e.g.
+
+        pool = ReadPool("sotorrent.sqlite3")
+        question, answers = pool.post_with_answers(4)
+        for version in pool.post_history(4):
+            print(version.CreationDate, version.Text)
+    """
+
+    def __init__(self, db_file=main.db_file, size=4):
+        self.db_file = os.path.abspath(db_file)
+        self.size = size
+        self.idle = LifoQueue()
+        self.lock = Lock()
+        self.opened = 0
+        self.closed = False
+        self.post = lru_cache(lookup_cache_size)(self._post)
+        self.post_with_answers = lru_cache(lookup_cache_size)(self._post_with_answers)
+
+    def open(self):
+        if not os.path.exists(self.db_file):
+            raise FileNotFoundError(self.db_file)
+        conn = connect("file:{}?mode=ro".format(pathname2url(self.db_file)), uri=True,
+                       check_same_thread=False, cached_statements=cached_statements)
+        main.register_functions(conn)
+        conn.execute("PRAGMA mmap_size = {};".format(mmap_size)).fetchall()
+        # shards of a --shards build are merged and removed, --keep-shards keeps
+        # them; databases built before the Metadata table have none
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Metadata'"
+                        ).fetchone() and any(
+                os.path.exists(os.path.join(os.path.dirname(self.db_file), shard_name))
+                for (shard_name,) in conn.execute(
+                    "SELECT DISTINCT Value FROM Metadata WHERE Key LIKE 'shard:%'")):
+            main.attach_shards(conn)
+        conn.execute("PRAGMA query_only = ON;")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one when size are in use"""
+        if self.closed:
+            raise ValueError("the ReadPool is closed")
+        try:
+            conn = self.idle.get_nowait()
+        except Empty:
+            with self.lock:
+                opening = self.opened < self.size
+                self.opened += opening
+            if opening:
+                try:
+                    conn = self.open()
+                except Exception:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            if self.closed:
+                conn.close()
+                with self.lock:
+                    self.opened -= 1
+            else:
+                self.idle.put(conn)
+
+    def query(self, sql, params=(), row_type=None):
+        """Yield the rows of sql, as row_type if given"""
+        with self.connection() as conn:
+            cursor = conn.execute(sql, params)
+            try:
+                for row in cursor:
+                    yield row if row_type is None else row_type._make(row)
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Close the idle connections, borrowed ones are closed when returned
+
+        The pool lends no connections afterwards.
+        """
+        self.closed = True
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+    def _post(self, post_id):
+        """The Post of post_id, None if there is none"""
+        with self.connection() as conn:
+            row = conn.execute(sql_post, (post_id,)).fetchone()
+        return None if row is None else Post._make(row)
+
+    def answers(self, post_id):
+        """Yield the answers to the question post_id"""
+        return self.query(sql_answers, (post_id,), Post)
+
+    def _post_with_answers(self, post_id):
+        """(Post, tuple of its answers) of post_id, (None, ()) if there is none"""
+        post = self._post(post_id)
+        if post is None:
+            return None, ()
+        return post, tuple(self.answers(post_id))
+
+    def post_history(self, post_id):
+        """Yield the PostHistory events of post_id in the order they happened"""
+        return self.query(sql_post_history, (post_id,), PostHistory)
+
+    def post_urls(self, post_id):
+        """Yield the PostVersionUrl rows of every version of post_id"""
+        return self.query(sql_post_urls, (post_id,), PostVersionUrl)
+
+    def comment_urls(self, post_id):
+        """Yield the CommentUrl rows of the comments on post_id"""
+        return self.query(sql_comment_urls, (post_id,), CommentUrl)
+
+    def tagged_posts(self, tag_name):
+        """Yield the posts tagged tag_name, e.g. 'python'
+
+        Needs a database built with --post-tags, the posts are a range of
+        PostTags.
+        """
+        return self.query(sql_tagged_posts, (tag_name,), Post)
+
+    def github_matches(self, post_id):
+        """Yield the GHMatches lines matching post_id
+
+        Needs a database built with --ghmatch-posts, the files are found in
+        GHMatchPost and their lines through GHMatches(FileId).
+        """
+        post_id = int(post_id)
+        for match in self.query(sql_github_matches, (post_id,), GHMatch):
+            if post_id in main.split_ids(getattr(match, ghmatch_posts_column),
+                                         ghmatch_posts_separator):
+                yield match
+
+    def post_version_text(self, post_history_id):
+        """Markdown of the post version post_history_id, None if there is none
+
+        Needs a database built with --post-version-text.
+        """
+        with self.connection() as conn:
+            row = conn.execute(sql_post_version_text, (post_history_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def github_references(self, post_id):
+        """Yield the PostReferenceGH rows of GitHub files copying from post_id"""
+        return self.query(sql_github_references, (post_id,), PostReferenceGH)
@@ -0,0 +1,58 @@
+import os
+import sys
+from sqlite3 import connect
+
+import pytest
+
+# the modules are scripts at the top of the repository, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench  # noqa: E402
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def dump(tmp_path_factory):
+    """Directory of small generated input files, see bench.DumpGenerator"""
+    directory = str(tmp_path_factory.mktemp("dump"))
+    bench.DumpGenerator(directory, 300, seed=1).generate()
+    return directory
+
+
+@pytest.fixture
+def build(monkeypatch):
+    """Run main.py with argv on the inputs of data_dir into db_path"""
+
+    def build(data_dir, db_path, *argv):
+        # main() sets these globals from its options, restore them afterwards
+        for name in ["script_dir", "db_file", "metrics", "commit_bytes_limits",
+                     "commit_seconds", "slow_commit_fraction"]:
+            monkeypatch.setattr(main, name, getattr(main, name))
+        main.script_dir = str(data_dir)
+        main.db_file = str(db_path)
+        monkeypatch.setattr(sys, "argv", ["main.py"] + list(argv))
+        main.main()
+        return str(db_path)
+
+    return build
+
+
+@pytest.fixture
+def tables():
+    """{table: rows ordered by every column} of the loaded tables of a database,
+    read through their views"""
+
+    def tables(db_path, names=main.loaded_tables):
+        conn = connect(db_path)
+        main.register_functions(conn)
+        if conn.execute("SELECT 1 FROM Metadata WHERE Key LIKE 'shard:%'").fetchone() and \
+                os.path.exists(os.path.join(os.path.dirname(db_path), conn.execute(
+                    "SELECT Value FROM Metadata WHERE Key LIKE 'shard:%'").fetchone()[0])):
+            main.attach_shards(conn)
+        try:
+            return dict((name, sorted(conn.execute("SELECT * FROM {};".format(name)),
+                                      key=repr)) for name in names)
+        finally:
+            conn.close()
+
+    return tables
@@ -0,0 +1,66 @@
+import math
+from calendar import timegm
+from datetime import datetime
+from sqlite3 import connect
+
+import pytest
+
+import columns
+import main
+
+
+def expected_columns(db_path, table):
+    """{column: values} of an export_columns table as ColumnStore reads them,
+    computed from its rows with NULL as None"""
+    names = [column for column, _ in columns.export_columns[table]]
+    conn = connect(db_path)
+    main.register_functions(conn)
+    rows = conn.execute("SELECT {} FROM {} ORDER BY Id;".format(", ".join(names), table))
+    values = dict((name, list(column)) for name, column in zip(names, zip(*rows)))
+    conn.close()
+    for name in names:
+        if (table, name) in columns.date_columns:
+            values[name] = [None if value is None else timegm(datetime.strptime(
+                value, "%Y-%m-%dT%H:%M:%S.%f").timetuple()) * 1000 + int(value[-3:])
+                for value in values[name]]
+    return values
+
+
+@pytest.mark.parametrize("options", [[], ["--typed", "--compress"]])
+def test_export_round_trip(dump, build, tmp_path, options):
+    db_path = build(dump, tmp_path / "db.sqlite3", *options)
+    directory = str(tmp_path / "columns")
+    columns.export(db_path, directory)
+    store = columns.ColumnStore(directory)
+    nulls = set()  # typecodes of the NULLs read
+    for table, exported in sorted(columns.export_columns.items()):
+        expected = expected_columns(db_path, table)
+        assert store.rows(table) == len(expected["Id"]) > 0
+        for column, typecode in exported:
+            null = store.null(table, column)
+            values = list(store.column(table, column))
+            assert len(values) == store.rows(table)
+            for value, want in zip(values, expected[column]):
+                if want is None:
+                    nulls.add(typecode)
+                    assert math.isnan(value) if typecode in "fd" else value == null
+                else:
+                    assert value == want
+    assert "d" in nulls and "q" in nulls
+    store.close()
+
+
+def test_export_empty_table(dump, build, tmp_path):
+    db_path = build(dump, tmp_path / "db.sqlite3", "--typed")
+    conn = connect(db_path)
+    conn.execute("DELETE FROM {};".format(main.storage_table(conn, "TitleVersion")))
+    conn.commit()
+    conn.close()
+    directory = str(tmp_path / "columns")
+    columns.export(db_path, directory, ["TitleVersion", "Votes"])
+    store = columns.ColumnStore(directory)
+    assert store.rows("TitleVersion") == 0
+    for column, _ in columns.export_columns["TitleVersion"]:
+        assert len(store.column("TitleVersion", column)) == 0
+    assert len(store.column("Votes", "Id")) == store.rows("Votes") > 0
+    store.close()
@@ -0,0 +1,66 @@
+from sqlite3 import connect
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def conn():
+    """In-memory database of the tables indexed with --fts --fts-split-code"""
+    conn = connect(":memory:")
+    main.create_progress_table(conn)
+    main.set_metadata(conn, [("fts", 1), ("fts_split_code", 1)])
+    conn.execute("CREATE TABLE Posts (Id INTEGER PRIMARY KEY, Body TEXT);")
+    conn.execute("CREATE TABLE Comments (Id INTEGER PRIMARY KEY, Text TEXT);")
+    conn.execute("CREATE TABLE PostBlockVersion "
+                 "(Id INTEGER PRIMARY KEY, PostBlockTypeId INT, Content TEXT);")
+    conn.executemany("INSERT INTO Posts VALUES (?, ?);", [(1, "running sqlite3")])
+    conn.executemany("INSERT INTO Comments VALUES (?, ?);", [(1, "a comment")])
+    conn.executemany("INSERT INTO PostBlockVersion VALUES (?, ?, ?);", [
+        (1, 1, "running queries"),
+        (2, 2, "foo_bar = run()"),
+        (3, 1, "more text"),
+        (4, 2, "$x = foo_bar"),
+    ])
+    conn.commit()
+    main.create_fts_indices(conn)
+    yield conn
+    conn.close()
+
+
+def integrity_check(conn, name):
+    """Check the index against its content table (rank 1), not only itself"""
+    conn.execute("INSERT INTO {0} ({0}, rank) VALUES ('integrity-check', 1);".format(name))
+
+
+def matches(conn, name, query):
+    return [rowid for (rowid,) in conn.execute(
+        "SELECT rowid FROM {0} WHERE {0} MATCH ? ORDER BY rowid;".format(name), (query,))]
+
+
+@pytest.mark.parametrize("name", ["PostBlockTextFts", "PostBlockCodeFts"])
+def test_split_indices_pass_integrity_check(conn, name):
+    integrity_check(conn, name)
+    conn.execute("INSERT INTO {0} ({0}) VALUES ('rebuild');".format(name))
+    integrity_check(conn, name)
+
+
+def test_split_indices_hold_their_block_type(conn):
+    conn.execute("INSERT INTO PostBlockTextFts (PostBlockTextFts) VALUES ('rebuild');")
+    conn.execute("INSERT INTO PostBlockCodeFts (PostBlockCodeFts) VALUES ('rebuild');")
+    assert matches(conn, "PostBlockTextFts", "run") == [1]  # stemmed
+    assert matches(conn, "PostBlockTextFts", "foo_bar") == []
+    assert matches(conn, "PostBlockCodeFts", '"foo_bar"') == [2, 4]
+    assert matches(conn, "PostBlockCodeFts", "queries") == []
+
+
+def test_update_triggers_keep_split_indices_consistent(conn):
+    main.create_fts_triggers(conn)
+    conn.execute("UPDATE PostBlockVersion SET Content = 'changed words' WHERE Id = 1;")
+    conn.execute("INSERT INTO PostBlockVersion VALUES (5, 2, 'new_code()');")
+    for name in ["PostBlockTextFts", "PostBlockCodeFts"]:
+        integrity_check(conn, name)
+    assert matches(conn, "PostBlockTextFts", "changed") == [1]
+    assert matches(conn, "PostBlockTextFts", "queries") == []
+    assert matches(conn, "PostBlockCodeFts", '"new_code"') == [5]
@@ -0,0 +1,45 @@
+import os
+import shutil
+from csv import reader, writer, field_size_limit, QUOTE_ALL
+from sqlite3 import connect
+
+import main
+import sotorrent
+
+
+def test_stray_post_ids_are_skipped():
+    source = main.JunctionCsvSource(main.ghmatches_csv_table)
+    data = b'"f1","12; 34;;x","a"\n"f2"," 7 ","b"\n"f3","x;","c"\n'
+    (_, rows), (_, pairs) = source.parse(0, data)
+    assert [row[1] for row in rows] == ["12; 34;;x", " 7 ", "x;"]
+    assert sorted(pairs) == [(7, "f2"), (12, "f1"), (34, "f1")]
+
+    filters = [(1, main.IdSet([34]), ";")]
+    assert main.filter_rows(rows, filters) == rows[:1]
+
+
+def test_build_links_stray_post_ids(dump, build, tmp_path):
+    data = str(tmp_path / "data")
+    shutil.copytree(dump, data)
+    path = os.path.join(data, "GHMatches.csv")
+    field_size_limit(2 ** 31 - 1)
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(reader(f))
+    rows[1][1] = "12; 34;;x"  # the first row after the header
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer(f, quoting=QUOTE_ALL, lineterminator="\n").writerows(rows)
+
+    db_path = build(data, tmp_path / "db.sqlite3", "--ghmatch-posts")
+    conn = connect(db_path)
+    assert conn.execute("SELECT PostId FROM GHMatchPost WHERE FileId = ? ORDER BY PostId;",
+                        (rows[1][0],)).fetchall() == [(12,), (34,)]
+    conn.close()
+    pool = sotorrent.ReadPool(db_path)
+    assert rows[1][0] in [match.FileId for match in pool.github_matches(34)]
+    pool.close()
+
+    subset = build(data, tmp_path / "subset.sqlite3", "--ghmatch-posts", "--subset-ids", "1:40")
+    conn = connect(subset)
+    assert conn.execute("SELECT count(*) FROM GHMatches WHERE FileId = ?;",
+                        (rows[1][0],)).fetchone() == (1,)
+    conn.close()
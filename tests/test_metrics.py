@@ -0,0 +1,40 @@
+import json
+from time import sleep
+
+import pytest
+
+import main
+
+
+def stall(monkeypatch, table, chunk, seconds):
+    """Make the load of table wait seconds for its chunk after chunk chunks"""
+    def parsed_chunks(source, *args, chunked=main.parsed_chunks):
+        for count, parsed in enumerate(chunked(source, *args)):
+            if source.table == table and count == chunk:
+                sleep(seconds)
+            yield parsed
+    monkeypatch.setattr(main, "parsed_chunks", parsed_chunks)
+
+
+@pytest.mark.parametrize("fraction, warned", [("0.25", True), ("0", False)])
+def test_slow_commit_is_logged_and_warned(dump, build, tmp_path, monkeypatch, capsys,
+                                          fraction, warned):
+    # one commit per chunk of Posts.xml, the tenth waits half a second
+    monkeypatch.setattr(main, "read_block", 1 << 12)
+    stall(monkeypatch, "Posts", 9, 0.5)
+    metrics = tmp_path / "metrics.jsonl"
+    build(dump, tmp_path / "db.sqlite3", "--commit-mb", "0:0", "--metrics", str(metrics),
+          "--slow-commit-fraction", fraction)
+
+    with open(str(metrics)) as f:
+        events = [json.loads(line) for line in f]
+    slow = [event for event in events if event["event"] == "slow_commit"]
+    out = capsys.readouterr().out
+    if not warned:
+        assert not slow and "Warning: commit no" not in out
+        return
+    # a hiccup on a busy machine may slow another commit too
+    event, = [event for event in slow if (event["table"], event["commit"]) == ("Posts", 10)]
+    assert event["rows_per_s"] < 0.25 * event["average_rows_per_s"]
+    assert event["parse_s"] >= 0.5
+    assert "Warning: commit no 10 of Posts ran at" in out
@@ -0,0 +1,64 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+import main
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, table, chunks):
+    """Make the load of table fail when it asks for its chunk after chunks"""
+    for name in ["parsed_chunks", "pipelined_chunks"]:
+        def interrupted(source, *args, chunked=getattr(main, name)):
+            for count, chunk in enumerate(chunked(source, *args)):
+                if source.table == table and count == chunks:
+                    raise Interrupted(table)
+                yield chunk
+        monkeypatch.setattr(main, name, interrupted)
+
+
+def gzipped(dump, directory):
+    os.makedirs(directory)
+    for name in os.listdir(dump):
+        with open(os.path.join(dump, name), "rb") as f, \
+                gzip.open(os.path.join(directory, name + ".gz"), "wb") as g:
+            shutil.copyfileobj(f, g)
+    return directory
+
+
+@pytest.mark.parametrize("table, gz, workers", [
+    ("Posts", False, 0),
+    ("Posts", True, 2),
+    ("PostBlockVersion", False, 2),
+    ("PostBlockVersion", True, 0),
+])
+def test_resume_matches_uninterrupted_build(dump, build, tables, tmp_path, monkeypatch,
+                                            capsys, table, gz, workers):
+    data = gzipped(dump, str(tmp_path / "gz")) if gz else dump
+    # one commit per chunk, several chunks per table
+    monkeypatch.setattr(main, "read_block", 1 << 12)
+    argv = ["--workers", str(workers), "--commit-mb", "0:0"]
+    reference = build(data, tmp_path / "reference.sqlite3", *argv)
+
+    interrupt_after(monkeypatch, table, 2)
+    with pytest.raises(Interrupted):
+        build(data, tmp_path / "resumed.sqlite3", *argv)
+    conn = main.connect(str(tmp_path / "resumed.sqlite3"))
+    step = "2_load_so_from_xml" if table == "Posts" else "6_load_sotorrent"
+    rows, offset, done = main.get_progress(conn, step, table)
+    conn.close()
+    assert rows > 0 and offset > 0 and not done
+    monkeypatch.undo()
+
+    monkeypatch.setattr(main, "read_block", 1 << 12)
+    capsys.readouterr()
+    resumed = build(data, tmp_path / "resumed.sqlite3", "--resume", *argv)
+    out = capsys.readouterr().out
+    assert "Resuming {} at".format(table) in out
+    assert "from row {} (byte {})".format(rows, offset) in out
+    assert tables(resumed) == tables(reference)
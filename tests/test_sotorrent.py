@@ -0,0 +1,98 @@
+import threading
+from sqlite3 import connect, ProgrammingError
+from time import sleep
+
+import pytest
+
+import sotorrent
+
+post_ids = range(1, 60)
+lookups = ["post_with_answers", "post_history", "post_urls", "comment_urls",
+           "github_references", "github_matches"]
+
+
+def read(db_path, version_text=True):
+    """{(lookup, argument): result} of every ReadPool lookup on the database"""
+    pool = sotorrent.ReadPool(db_path)
+    try:
+        result = {("tagged_posts", "python"): list(pool.tagged_posts("python"))}
+        for post_id in post_ids:
+            for lookup in lookups:
+                value = getattr(pool, lookup)(post_id)
+                result[lookup, post_id] = value if isinstance(value, tuple) else list(value)
+            if version_text:  # of the PostHistoryIds of the same range
+                result["post_version_text", post_id] = pool.post_version_text(post_id)
+        return result
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize("options", [
+    ["--typed", "--post-version-text"],
+    ["--compress", "--dedup-content", "--intern-urls", "--post-version-text"],
+    ["--typed", "--compress", "--shards", "2", "--keep-shards"],
+])
+def test_reads_like_a_plain_build(dump, build, tmp_path, options):
+    linked = ["--ghmatch-posts", "--post-tags"]
+    version_text = "--post-version-text" in options
+    plain = build(dump, tmp_path / "plain.sqlite3", "--post-version-text", *linked)
+    stored = build(dump, tmp_path / "stored.sqlite3", *(options + linked))
+    expected = read(plain, version_text)
+    assert read(stored, version_text) == expected
+    for lookup in ["post_history", "post_urls", "comment_urls", "github_references",
+                   "github_matches"] + ["post_version_text"] * version_text:
+        assert any(expected.get((lookup, post_id)) for post_id in post_ids), lookup
+    assert expected["tagged_posts", "python"]
+    question, answers = expected["post_with_answers", 1]
+    assert all(answer.ParentId == question.Id for answer in answers)
+
+
+def test_pool_opens_at_most_size_connections(dump, build, tmp_path):
+    pool = sotorrent.ReadPool(build(dump, tmp_path / "db.sqlite3"), size=3)
+    lock = threading.Lock()
+    borrowed = set()
+    most = []
+
+    def borrow():
+        for _ in range(5):
+            with pool.connection() as conn:
+                with lock:
+                    borrowed.add(id(conn))
+                    most.append(len(borrowed))
+                assert conn.execute("SELECT count(*) FROM Posts;").fetchone()[0]
+                sleep(0.01)
+                with lock:
+                    borrowed.discard(id(conn))
+
+    threads = [threading.Thread(target=borrow) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(most) == 3 and pool.opened == 3 and len(most) == 50
+    pool.close()
+    assert pool.opened == 0
+
+
+def test_close_while_borrowed(dump, build, tmp_path):
+    db_path = build(dump, tmp_path / "db.sqlite3")
+    conn = connect(db_path)
+    post_id, = conn.execute("SELECT PostId FROM PostHistory GROUP BY PostId "
+                            "ORDER BY count(*) DESC LIMIT 1;").fetchone()
+    conn.close()
+    pool = sotorrent.ReadPool(db_path, size=2)
+    history = pool.post_history(post_id)
+    first = next(history)  # the generator holds a connection until exhausted
+    with pool.connection() as conn:
+        pool.close()
+        # borrowed connections stay usable until they are returned
+        assert conn.execute("SELECT count(*) FROM Posts;").fetchone()[0]
+        rest = list(history)
+        assert pool.opened == 1
+    assert [version.Id for version in [first] + rest] == sorted(
+        version.Id for version in [first] + rest)
+    with pytest.raises(ProgrammingError):
+        conn.execute("SELECT 1;")
+    assert pool.opened == 0
+    with pytest.raises(ValueError):
+        pool.post(post_id)
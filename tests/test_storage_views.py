@@ -0,0 +1,24 @@
+from sqlite3 import connect
+
+import pytest
+
+
+@pytest.mark.parametrize("options", [
+    ["--typed"],
+    ["--typed", "--compact-schema", "--compress", "--dedup-content", "--intern-urls"],
+])
+def test_views_read_like_a_plain_build(dump, build, tables, tmp_path, options):
+    plain = build(dump, tmp_path / "plain.sqlite3")
+    stored = build(dump, tmp_path / "stored.sqlite3", *options)
+    assert tables(stored) == tables(plain)
+
+
+def test_typed_booleans_and_dates_compare_as_text(dump, build, tmp_path):
+    typed = connect(build(dump, tmp_path / "typed.sqlite3", "--typed"))
+    assert typed.execute("SELECT typeof(TagBased) FROM BadgesData LIMIT 1").fetchone() == (
+        "integer",)
+    assert typed.execute("SELECT count(*) FROM Badges WHERE TagBased = 'False'").fetchone()[0]
+    date, = typed.execute("SELECT CreationDate FROM PostVersion LIMIT 1").fetchone()
+    assert typed.execute("SELECT count(*) FROM PostVersion WHERE CreationDate = ?",
+                         (date,)).fetchone()[0]
+    assert len(date) == len("2008-07-31 21:42:52")
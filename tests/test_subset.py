@@ -0,0 +1,47 @@
+from sqlite3 import connect
+
+import pytest
+
+import main
+from test_resume import Interrupted, interrupt_after
+
+
+@pytest.mark.parametrize("options", [
+    ["--subset-ids", "3:40"],
+    ["--subset-ids", "3:40", "--subset-tag", "python,java"],
+    ["--subset-year", "2008"],
+])
+def test_subset_has_no_dangling_post_references(dump, build, tmp_path, options):
+    conn = connect(build(dump, tmp_path / "subset.sqlite3", *options))
+    assert conn.execute("SELECT count(*) FROM Posts WHERE ParentId IS NOT NULL;").fetchone()[0]
+    for column in ["ParentId", "AcceptedAnswerId"]:
+        assert conn.execute(
+            "SELECT count(*) FROM Posts WHERE {0} IS NOT NULL "
+            "AND {0} NOT IN (SELECT Id FROM Posts);".format(column)).fetchone() == (0,)
+    if "--subset-ids" in options:
+        # answers are selected by their question, not by their own Id
+        assert conn.execute("SELECT count(*) FROM Posts WHERE ParentId IS NULL "
+                            "AND Id NOT BETWEEN 3 AND 40;").fetchone() == (0,)
+    conn.close()
+
+
+def test_resumed_subset_builds_filters_of_tables_to_load(dump, build, tables, tmp_path,
+                                                         monkeypatch):
+    argv = ["--subset-ids", "3:40", "--commit-mb", "0:0"]
+    monkeypatch.setattr(main, "read_block", 1 << 12)
+    reference = build(dump, tmp_path / "reference.sqlite3", *argv)
+    interrupt_after(monkeypatch, "Comments", 1)
+    with pytest.raises(Interrupted):
+        build(dump, tmp_path / "resumed.sqlite3", *argv)
+    monkeypatch.undo()
+
+    monkeypatch.setattr(main, "read_block", 1 << 12)
+    filtered = []
+
+    def subset_filters(conn, table, columns, built=main.subset_filters):
+        filtered.append(table)
+        return built(conn, table, columns)
+    monkeypatch.setattr(main, "subset_filters", subset_filters)
+    resumed = build(dump, tmp_path / "resumed.sqlite3", "--resume", *argv)
+    assert "Posts" not in filtered and "Comments" in filtered
+    assert tables(resumed) == tables(reference)
@@ -0,0 +1,121 @@
+import os
+import re
+import shutil
+from csv import reader, writer, field_size_limit, QUOTE_ALL
+from sqlite3 import connect
+
+import pytest
+
+import main
+
+appended = 3  # rows of new Ids at the end of every input file
+
+
+def newer_xml(path, table):
+    """Change rows of a changing xml table and append rows of new Ids"""
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    rows = [i for i, line in enumerate(lines) if line.lstrip().startswith("<row ")]
+    if table in main.update_changing_tables:
+        for i in rows[::7]:
+            line = lines[i].replace(' Body="', ' Body="&lt;p&gt;quokka&lt;/p&gt;')
+            line = line.replace(' Text="', ' Text="quokka ')
+            line = re.sub(r' Tags="[^"]*"', ' Tags="&lt;rust&gt;&lt;quokka&gt;"', line)
+            lines[i] = line.replace(' Score="', ' Score="1')
+    last = max(int(re.search(r'\bId="(-?\d+)"', lines[i]).group(1)) for i in rows)
+    new = [re.sub(r'\bId="-?\d+"', 'Id="{}"'.format(last + k + 1), lines[rows[k]])
+           .replace(' TagName="', ' TagName="new-') for k in range(appended)]
+    lines[rows[-1] + 1:rows[-1] + 1] = new
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.writelines(lines)
+
+
+def newer_csv(path, table):
+    """Change Content and Title of changing csv tables, append rows of new
+    Ids (and PostHistoryIds, which are unique with the other columns) and
+    replace the first row of a keyless table"""
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(reader(f))
+    header = [rows.pop(0)] if table.skip_header else []
+    if table.name in main.update_keyless_tables:
+        rows = rows[1:] + [row[:-1] + ["quokka " + row[-1]] for row in rows[:1]]
+    else:
+        text = [table.columns.index(name) for name in ["Content", "Title"]
+                if name in table.columns]
+        if table.name in main.update_changing_tables:
+            for row in rows[::5]:
+                for i in text:
+                    row[i] = "quokka " + row[i]
+        history = table.columns.index("PostHistoryId") \
+            if "PostHistoryId" in table.columns else None
+        last = max(int(row[0]) for row in rows)
+        for k in range(appended):
+            row = list(rows[k])
+            row[0] = str(last + k + 1)
+            if history is not None:
+                row[history] = str(10 ** 6 + k)
+            rows.append(row)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer(f, quoting=QUOTE_ALL, lineterminator="\n").writerows(header + rows)
+
+
+@pytest.fixture(scope="module")
+def newer(dump, tmp_path_factory):
+    """The generated dump with changed and appended rows, as a newer release"""
+    field_size_limit(2 ** 31 - 1)
+    directory = str(tmp_path_factory.mktemp("newer"))
+    for name in os.listdir(dump):
+        shutil.copy(os.path.join(dump, name), directory)
+    for table in main.so_xml_tables:
+        newer_xml(os.path.join(directory, "{}.xml".format(table)), table)
+    for table in main.sotorrent_csv_tables + [main.postreferencegh_csv_table,
+                                              main.ghmatches_csv_table]:
+        newer_csv(os.path.join(directory, "{}.csv".format(table.name)), table)
+    return directory
+
+
+def fts_matches(db_path, words):
+    """{(index, word): rowids} of the --fts indices, after checking each
+    index against the rows of its content view"""
+    conn = connect(db_path)
+    main.register_functions(conn)
+    try:
+        result = {}
+        for name, *_ in main.fts_indices + main.fts_split_indices:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                (name,)).fetchone():
+                continue
+            conn.execute("INSERT INTO {0} ({0}, rank) VALUES ('integrity-check', 1);".format(
+                name))
+            for word in words:
+                result[name, word] = conn.execute(
+                    "SELECT rowid FROM {0} WHERE {0} MATCH ? ORDER BY rowid;".format(name),
+                    ('"{}"'.format(word),)).fetchall()
+        return result
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("options", [
+    ["--fts", "--post-version-text", "--post-tags"],
+    ["--typed", "--compress", "--dedup-content", "--intern-urls", "--fts",
+     "--fts-split-code", "--post-version-text", "--post-tags", "--ghmatch-posts"],
+])
+def test_update_matches_a_fresh_build(dump, newer, build, tables, tmp_path, options):
+    updated = build(dump, tmp_path / "updated.sqlite3", "--release", "r1", *options)
+    build(newer, updated, "--update", "--release", "r2")
+    fresh = build(newer, tmp_path / "fresh.sqlite3", "--release", "r2", *options)
+
+    names = main.loaded_tables + ["PostVersionText", "PostTags"]
+    assert tables(updated, names) == tables(fresh, names)
+    words = ["quokka", "python", "return", "select"]
+    matches = fts_matches(updated, words)
+    assert matches == fts_matches(fresh, words)
+    assert any(rowids for (name, word), rowids in matches.items() if word == "quokka")
+    conn = connect(updated)
+    main.register_functions(conn)
+    assert conn.execute("SELECT Value FROM Metadata WHERE Key = 'release';").fetchone() == (
+        "r2",)
+    assert conn.execute("SELECT count(*) FROM PostVersionText "
+                        "WHERE Content LIKE '%quokka%';").fetchone()[0]
+    conn.close()
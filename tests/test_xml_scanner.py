@@ -0,0 +1,92 @@
+from xml.etree.ElementTree import iterparse
+
+import pytest
+
+import main
+
+
+def write_dump(tmp_path, rows, newline="\n"):
+    """Write rows as the body of a Stack Exchange style dump, return its path"""
+    filepath = tmp_path / "Posts.xml"
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', "<posts>"] + rows + ["</posts>", ""]
+    filepath.write_bytes(newline.join(lines).encode("utf-8"))
+    return str(filepath)
+
+
+def scanned_rows(filepath):
+    source = main.XmlSource("Posts", [])
+    with open(filepath, "rb") as f:
+        return [dict(zip(columns, values))
+                for start, _, data in main.read_chunks(f, source.quoted)
+                for columns, values in source.scan(start, data)]
+
+
+def parsed_rows(filepath):
+    with open(filepath, "rb") as f:
+        return [dict(elm.attrib) for _, elm in iterparse(f, events=("end",))
+                if elm.tag == "row"]
+
+
+@pytest.fixture
+def fallbacks(monkeypatch):
+    """Lines the scanner hands to ElementTree"""
+    lines = []
+    fallback = main.XmlSource.fallback
+
+    def spy(self, line):
+        lines.append(line)
+        return fallback(self, line)
+
+    monkeypatch.setattr(main.XmlSource, "fallback", spy)
+    return lines
+
+
+@pytest.mark.parametrize("row", [
+    '  <row Id="1" Body="&lt;p&gt;a &amp;amp; b&lt;/p&gt;" Title="&quot;quoted&quot; &apos;x&apos;" />',
+    '  <row Id="2" Body="caf&#233; &#x263A; &#x1F600;" />',
+    '  <row Id="3" Body="line&#xD;&#xA;next&#xA;tab&#x9;end&#10;" />',
+    '  <row Id="4" Body="" Tags="&lt;python&gt;&lt;c#&gt;" />',
+    '  <row Id="5" Body="ünïcödé ☺" />',
+    '  <row Id="6" Body = "spaced equals" />',
+])
+def test_fast_path_matches_iterparse(tmp_path, fallbacks, row):
+    filepath = write_dump(tmp_path, [row])
+    assert scanned_rows(filepath) == parsed_rows(filepath)
+    assert not fallbacks
+
+
+@pytest.mark.parametrize("row", [
+    "  <row Id='1' Body='single \"quoted\" &amp; more' />",
+    '  <row Id="2"\n       Body="attributes on\n two lines" />',
+    '  <row Id="3" Body="literal\ttab" />',
+    '  <row Id="4" Body="literal\rcarriage return" />',
+])
+def test_fallback_matches_iterparse(tmp_path, fallbacks, row):
+    filepath = write_dump(tmp_path, [row, '  <row Id="9" Body="after" />'])
+    assert scanned_rows(filepath) == parsed_rows(filepath)
+    assert fallbacks
+
+
+def test_crlf_line_endings(tmp_path):
+    filepath = write_dump(tmp_path, [
+        '  <row Id="1" Body="a&#xD;&#xA;b" />',
+        '  <row Id="2" Body="x" Title="y" />',
+    ], newline="\r\n")
+    assert scanned_rows(filepath) == parsed_rows(filepath)
+
+
+def test_rows_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "read_block", 64)
+    rows = ['  <row Id="{0}" Body="row {0} &amp; &#x263A;" />'.format(i) for i in range(50)]
+    rows.insert(10, '  <row Id="100"\n       Body="spans\n lines" />')
+    rows.insert(30, "  <row Id='200' Body='single' />")
+    filepath = write_dump(tmp_path, rows)
+    assert scanned_rows(filepath) == parsed_rows(filepath)
+    assert main.verify_xml_scanner(filepath) == 0
+
+
+def test_verify_xml_scanner_reports_mismatches(tmp_path, monkeypatch):
+    filepath = write_dump(tmp_path, ['  <row Id="1" Body="a" />'])
+    monkeypatch.setattr(main.XmlSource, "scan", lambda self, start, data: iter(
+        [(("Id", "Body"), ["1", "b"])]))
+    assert main.verify_xml_scanner(filepath) == 1